@@ -0,0 +1,158 @@
+"""
+Shared helpers of the hybrid DQN runners (run_hybrid_dqn.py and
+run_proximity_hybrid.py).
+
+DensityActionTable picks the density-based fallback action and
+QNetworkPolicy runs the trained Q-network on batches of observations;
+both produce flat actions in the env's DQN action space.
+"""
+
+import copy
+
+import numpy as np
+import traci.constants as tc
+
+
+class DensityActionTable:
+    """
+    Density-based action without touching the DQN.
+    
+    Phases are taken from ``env.action_spec`` in the env's own order so the
+    chosen phase per junction maps directly onto the DQN's action index.
+    Each green lane of each phase becomes one entry in ``_lane_src`` (index
+    into ``_lanes``) and ``_lane_slot`` (flat ``junction * max_phases + phase``
+    slot), so a whole step's counts reduce with a single ``np.add.at``.
+    Build it once SUMO is up; it subscribes to the lane vehicle counts.
+    """
+    
+    def __init__(self, env):
+        """
+        Precompute the lane -> (junction, phase) grouping and subscribe to lane counts.
+        
+        Parameters
+        ----------
+        env : VANETTrafficEnv
+            Environment whose action spec, connection and action encoding
+            are used
+        """
+        self.env = env
+        conn = env.conn
+        
+        num_junctions = len(env.action_spec)
+        max_phases = max((len(phases) for phases in env.action_spec.values()), default=0)
+        lane_index = {}
+        lane_src = []
+        lane_slot = []
+        self._phase_valid = np.zeros((num_junctions, max_phases), dtype=bool)
+        
+        for j, (tl_id, phases) in enumerate(env.action_spec.items()):
+            links = conn.trafficlight.getControlledLinks(tl_id)
+            self._phase_valid[j, :len(phases)] = True
+            for phase_idx, state in enumerate(phases):
+                green = {links[i][0][0] for i, ch in enumerate(state)
+                         if ch in 'Gg' and i < len(links) and links[i]}
+                for lane_id in sorted(green):
+                    lane_src.append(lane_index.setdefault(lane_id, len(lane_index)))
+                    lane_slot.append(j * max_phases + phase_idx)
+        
+        self._lanes = list(lane_index)
+        self._lane_src = np.asarray(lane_src, dtype=np.int32)
+        self._lane_slot = np.asarray(lane_slot, dtype=np.int32)
+        
+        for lane_id in self._lanes:
+            conn.lane.subscribe(lane_id, [tc.LAST_STEP_VEHICLE_NUMBER])
+    
+    def action(self):
+        """
+        Pick, per junction, the phase whose green lanes hold the most vehicles.
+        
+        Returns
+        -------
+        int
+            The choice encoded as the env's flat DQN action
+        """
+        results = self.env.conn.lane.getAllSubscriptionResults()
+        per_lane = np.fromiter(
+            (results.get(lane_id, {}).get(tc.LAST_STEP_VEHICLE_NUMBER, 0) for lane_id in self._lanes),
+            dtype=np.int32, count=len(self._lanes))
+        
+        counts = np.zeros(self._phase_valid.size, dtype=np.int32)
+        np.add.at(counts, self._lane_slot, per_lane[self._lane_src])
+        counts = counts.reshape(self._phase_valid.shape)
+        counts[~self._phase_valid] = -1
+        
+        # argmax keeps the first phase on ties
+        return self.env.encode_action(counts.argmax(axis=1))
+
+
+class QNetworkPolicy:
+    """
+    Greedy actions from a loaded SB3 DQN, one Q-network pass per batch.
+    
+    Bypasses ``model.predict`` so the per-call SB3 preprocessing and
+    dispatch overhead is paid once per batch rather than once per obs.
+    """
+    
+    def __init__(self, model):
+        """
+        Prepare the Q-network for inference.
+        
+        Parameters
+        ----------
+        model : stable_baselines3.DQN
+            Loaded model; its policy keeps its own float32 weights
+        """
+        # torch/SB3 are imported here so the runners' --help does not pay for them
+        import torch as th
+        from stable_baselines3.common.torch_layers import FlattenExtractor
+        
+        self.model = model
+        self.device = model.policy.device
+        q_net = model.policy.q_net
+        if isinstance(q_net.features_extractor, FlattenExtractor):
+            # QNetwork.forward casts observations to float32 (preprocess_obs),
+            # so run a copy of the MLP behind the flatten extractor instead;
+            # half precision only pays off on GPU
+            self.dtype = th.float16 if self.device.type == 'cuda' else th.float32
+            self.q_net = th.nn.Sequential(th.nn.Flatten(), copy.deepcopy(q_net.q_net)).to(self.dtype)
+        else:
+            self.dtype = th.float32
+            self.q_net = q_net
+        
+        # Trace and freeze the small MLP so per-step forwards skip eager dispatch
+        self.q_net.eval()
+        example = th.zeros((1,) + model.observation_space.shape, dtype=self.dtype, device=self.device)
+        try:
+            self.q_net = th.jit.freeze(th.jit.trace(self.q_net, example))
+        except Exception as e:
+            print(f"  ⚠️  Q-network tracing failed, running eagerly ({e})")
+    
+    def predict(self, obs_list, deterministic=True):
+        """
+        Predict actions for a batch of observations.
+        
+        Parameters
+        ----------
+        obs_list : list of np.ndarray
+            Observations to evaluate (stacked along a new batch axis)
+        deterministic : bool
+            If False, each action is replaced by a random one with the
+            model's final exploration rate, matching ``model.predict``
+        
+        Returns
+        -------
+        np.ndarray
+            Action index per observation
+        """
+        import torch as th
+        
+        obs_batch = th.as_tensor(np.stack(obs_list)).to(self.device, self.dtype, non_blocking=True)
+        with th.inference_mode():
+            actions = self.q_net(obs_batch).argmax(dim=1).cpu().numpy()
+        
+        if not deterministic:
+            explore = np.random.rand(len(actions)) < self.model.exploration_rate
+            for i in np.flatnonzero(explore):
+                actions[i] = self.model.action_space.sample()
+        
+        return actions
@@ -4,8 +4,11 @@ Proximity-Based Hybrid Control Logic for Integration
 Provides junction-specific switching based on emergency vehicle proximity.
 """
 
+import math
 import traci
-import numpy as np
+
+# Mode names indexed by the integer codes kept in ProximityHybridLogic._jmodes
+MODE_NAMES = ("DENSITY", "RL")
 
 
 class ProximityHybridLogic:
@@ -25,7 +28,11 @@ class ProximityHybridLogic:
         """
         self.proximity_threshold = proximity_threshold
         self.junction_positions = {}
-        self.junction_modes = {}
+        
+        # Per-junction modes as parallel lists (0 = DENSITY, 1 = RL)
+        self._jids = []
+        self._jmodes = []
+        self._jid_to_idx = {}
         
         # Statistics
         self.stats = {
@@ -35,6 +42,19 @@ class ProximityHybridLogic:
             'junction_switches': 0,
         }
     
+    @property
+    def junction_modes(self):
+        """Dictionary mapping junction_id -> mode ("DENSITY" or "RL")."""
+        return {jid: MODE_NAMES[mode] for jid, mode in zip(self._jids, self._jmodes)}
+    
+    def _add_junction(self, tl_id, position):
+        """Record a junction position and start it in DENSITY mode."""
+        self.junction_positions[tl_id] = position
+        if tl_id not in self._jid_to_idx:
+            self._jid_to_idx[tl_id] = len(self._jids)
+            self._jids.append(tl_id)
+            self._jmodes.append(0)
+    
     def initialize_junctions(self):
         """Initialize junction positions from SUMO."""
         tl_ids = traci.trafficlight.getIDList()
@@ -44,8 +64,7 @@ class ProximityHybridLogic:
                 # Try to get actual junction position
                 junction_id = tl_id  # Traffic light ID usually matches junction ID
                 junction_pos = traci.junction.getPosition(junction_id)
-                self.junction_positions[tl_id] = junction_pos
-                self.junction_modes[tl_id] = "DENSITY"
+                self._add_junction(tl_id, junction_pos)
                 print(f"  {tl_id}: Position ({junction_pos[0]:.1f}, {junction_pos[1]:.1f})")
             except:
                 # Fallback: use controlled lanes average
@@ -66,8 +85,7 @@ class ProximityHybridLogic:
                         if all_x and all_y:
                             x = sum(all_x) / len(all_x)
                             y = sum(all_y) / len(all_y)
-                            self.junction_positions[tl_id] = (x, y)
-                            self.junction_modes[tl_id] = "DENSITY"
+                            self._add_junction(tl_id, (x, y))
                             print(f"  {tl_id}: Position ({x:.1f}, {y:.1f}) [fallback]")
                 except Exception as e:
                     print(f"  ⚠️  {tl_id}: Could not get position ({e})")
@@ -111,10 +129,7 @@ class ProximityHybridLogic:
                 
                 # Check distance to each junction
                 for junction_id, junction_pos in self.junction_positions.items():
-                    distance = np.sqrt(
-                        (veh_pos[0] - junction_pos[0])**2 + 
-                        (veh_pos[1] - junction_pos[1])**2
-                    )
+                    distance = math.hypot(veh_pos[0] - junction_pos[0], veh_pos[1] - junction_pos[1])
                     
                     if distance <= self.proximity_threshold:
                         rl_junctions.add(junction_id)
@@ -135,25 +150,22 @@ class ProximityHybridLogic:
         rl_junctions = self.get_emergency_junction_proximity()
         
         # Update modes and track switches
-        for junction_id in self.junction_modes:
-            old_mode = self.junction_modes[junction_id]
-            new_mode = "RL" if junction_id in rl_junctions else "DENSITY"
+        jmodes = self._jmodes
+        for i, junction_id in enumerate(self._jids):
+            target = 1 if junction_id in rl_junctions else 0
             
-            if old_mode != new_mode:
+            if jmodes[i] != target:
                 self.stats['junction_switches'] += 1
-                print(f"  Junction {junction_id}: {old_mode} → {new_mode}")
-            
-            self.junction_modes[junction_id] = new_mode
+                print(f"  Junction {junction_id}: {MODE_NAMES[jmodes[i]]} → {MODE_NAMES[target]}")
+                jmodes[i] = target
         
         # Update step statistics
         self.stats['total_steps'] += 1
-        for mode in self.junction_modes.values():
-            if mode == "RL":
-                self.stats['rl_steps'] += 1
-            else:
-                self.stats['density_steps'] += 1
+        rl_count = sum(jmodes)
+        self.stats['rl_steps'] += rl_count
+        self.stats['density_steps'] += len(jmodes) - rl_count
         
-        return self.junction_modes.copy()
+        return self.junction_modes
     
     def should_use_rl(self, junction_id):
         """
@@ -169,7 +181,8 @@ class ProximityHybridLogic:
         bool
             True if junction should use RL, False for density
         """
-        return self.junction_modes.get(junction_id, "DENSITY") == "RL"
+        idx = self._jid_to_idx.get(junction_id)
+        return idx is not None and self._jmodes[idx] == 1
     
     def get_statistics(self):
         """Get control statistics."""
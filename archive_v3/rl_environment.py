@@ -17,6 +17,59 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from sumo_simulation.traffic_controller import AdaptiveTrafficController
 
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Fallback no-op decorator when numba is not installed"""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+@njit(cache=True)
+def build_state(out, queues, waits, phases, times, edge_feats, sec_feats):
+    """
+    Pack per-TL features into the flat state vector
+    
+    Layout per TL: queue(4) + wait(4) + phase one-hot(4) + time(1)
+    + edge features + security features
+    
+    Args:
+        out: Preallocated float32 state vector
+        queues: (num_tls, 4) halting vehicles per lane
+        waits: (num_tls, 4) waiting time per lane
+        phases: (num_tls,) current phase index (-1 if unknown)
+        times: (num_tls,) scaled time since last phase change
+        edge_feats: (num_tls, 4) edge features, or (num_tls, 0) if disabled
+        sec_feats: (num_tls, 2) security features, or (num_tls, 0) if disabled
+        
+    Returns:
+        out: The filled state vector
+    """
+    num_edge = edge_feats.shape[1]
+    num_sec = sec_feats.shape[1]
+    stride = 13 + num_edge + num_sec
+    
+    for t in range(queues.shape[0]):
+        base = t * stride
+        for k in range(4):
+            out[base + k] = queues[t, k]
+            out[base + 4 + k] = waits[t, k]
+            out[base + 8 + k] = 0.0
+        if 0 <= phases[t] < 4:
+            out[base + 8 + phases[t]] = 1.0
+        out[base + 12] = times[t]
+        for k in range(num_edge):
+            out[base + 13 + k] = edge_feats[t, k]
+        for k in range(num_sec):
+            out[base + 13 + num_edge + k] = sec_feats[t, k]
+    
+    return out
+
 
 class TrafficEnvironment:
     """
@@ -174,6 +227,15 @@ class TrafficEnvironment:
         
         self.state_dim = base_dim_per_tl * len(self.tl_ids)
         
+        # Per-step feature scratch buffers consumed by build_state
+        num_tls = len(self.tl_ids)
+        self._queues = np.zeros((num_tls, 4), dtype=np.float32)
+        self._waits = np.zeros((num_tls, 4), dtype=np.float32)
+        self._phases = np.full(num_tls, -1, dtype=np.int64)
+        self._times = np.zeros(num_tls, dtype=np.float32)
+        self._edge_feats = np.zeros((num_tls, 4 if self.edge_enabled else 0), dtype=np.float32)
+        self._sec_feats = np.zeros((num_tls, 2 if self.security_enabled else 0), dtype=np.float32)
+        
         # Get actual number of phases from SUMO for each TL
         self.phases_per_tl = {}
         for tl_id in self.tl_ids:
@@ -200,9 +262,7 @@ class TrafficEnvironment:
         Returns:
             state: State vector
         """
-        state = []
-        
-        for tl_id in self.tl_ids:
+        for i, tl_id in enumerate(self.tl_ids):
             # Get controlled lanes
             lanes = traci.trafficlight.getControlledLanes(tl_id)
             unique_lanes = list(set(lanes))[:4]  # Take first 4 unique lanes
@@ -211,68 +271,62 @@ class TrafficEnvironment:
             while len(unique_lanes) < 4:
                 unique_lanes.append(unique_lanes[0] if unique_lanes else 'dummy')
             
-            # Queue lengths
-            queue_lengths = []
-            waiting_times = []
-            for lane in unique_lanes:
+            # Queue lengths and waiting times
+            for k, lane in enumerate(unique_lanes):
                 try:
-                    queue = traci.lane.getLastStepHaltingNumber(lane)
-                    wait = traci.lane.getWaitingTime(lane)
-                    queue_lengths.append(queue)
-                    waiting_times.append(wait)
+                    self._queues[i, k] = traci.lane.getLastStepHaltingNumber(lane)
+                    self._waits[i, k] = traci.lane.getWaitingTime(lane)
                 except:
-                    queue_lengths.append(0)
-                    waiting_times.append(0)
+                    self._queues[i, k] = 0
+                    self._waits[i, k] = 0
             
-            # Current phase (one-hot encoding)
+            # Current phase (one-hot encoded by build_state)
             try:
-                current_phase = traci.trafficlight.getPhase(tl_id)
-                phase_one_hot = [0] * 4
-                if current_phase < 4:
-                    phase_one_hot[current_phase] = 1
+                self._phases[i] = traci.trafficlight.getPhase(tl_id)
             except:
-                phase_one_hot = [0, 0, 0, 0]
+                self._phases[i] = -1
             
             # Time since last phase change
             time_since_change = self.current_step - self.last_phase_change.get(tl_id, 0)
-            
-            # Combine base features
-            tl_state = queue_lengths + waiting_times + phase_one_hot + [time_since_change / 100.0]
+            self._times[i] = time_since_change / 100.0
             
             # Add edge computing features
-            if self.edge_enabled and self.controller.edge_rsus:
+            if self.edge_enabled:
                 # Get edge metrics near this intersection
                 edge_warnings = 0
                 edge_emergencies = 0
                 edge_load = 0
                 edge_vehicles = 0
                 
-                # Find nearest RSU
-                tl_pos = self._get_tl_position(tl_id)
-                nearest_rsu = self._find_nearest_rsu(tl_pos)
-                
-                if nearest_rsu:
-                    stats = nearest_rsu.get_service_statistics()
-                    collision_stats = stats.get('collision_avoidance', {})
-                    emergency_stats = stats.get('emergency', {})
+                if self.controller.edge_rsus:
+                    # Find nearest RSU
+                    tl_pos = self._get_tl_position(tl_id)
+                    nearest_rsu = self._find_nearest_rsu(tl_pos)
                     
-                    edge_warnings = collision_stats.get('warnings_issued', 0) / 100.0
-                    edge_emergencies = emergency_stats.get('active_emergencies', 0)  # Already an int
-                    edge_load = stats.get('total_computations', 0) / 1000.0
-                    edge_vehicles = stats.get('unique_vehicles_served', 0) / 100.0
+                    if nearest_rsu:
+                        stats = nearest_rsu.get_service_statistics()
+                        collision_stats = stats.get('collision_avoidance', {})
+                        emergency_stats = stats.get('emergency', {})
+                        
+                        edge_warnings = collision_stats.get('warnings_issued', 0) / 100.0
+                        edge_emergencies = emergency_stats.get('active_emergencies', 0)  # Already an int
+                        edge_load = stats.get('total_computations', 0) / 1000.0
+                        edge_vehicles = stats.get('unique_vehicles_served', 0) / 100.0
                 
-                tl_state.extend([edge_warnings, edge_emergencies, edge_load, edge_vehicles])
+                self._edge_feats[i] = (edge_warnings, edge_emergencies, edge_load, edge_vehicles)
             
             # Add security features
             if self.security_enabled:
                 # Placeholder for security metrics
                 encrypted_ratio = 1.0  # Assume all encrypted
                 auth_failures = 0
-                tl_state.extend([encrypted_ratio, auth_failures])
-            
-            state.extend(tl_state)
+                self._sec_feats[i] = (encrypted_ratio, auth_failures)
         
-        return np.array(state, dtype=np.float32)
+        return build_state(
+            np.empty(self.state_dim, dtype=np.float32),
+            self._queues, self._waits, self._phases, self._times,
+            self._edge_feats, self._sec_feats
+        )
     
     def _execute_action(self, action: int):
         """
@@ -6,12 +6,12 @@ Implements DQN with experience replay for adaptive traffic light control
 
 import os
 import sys
+import copy
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
-from collections import deque
 import random
 from typing import List, Tuple, Dict, Any
 
@@ -19,10 +19,17 @@ from typing import List, Tuple, Dict, Any
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 
+@torch.jit.script
+def bellman(rewards: torch.Tensor, dones: torch.Tensor, gamma: float,
+            next_q: torch.Tensor) -> torch.Tensor:
+    """Bellman target, scripted so the elementwise chain fuses into one kernel"""
+    return rewards + (1.0 - dones) * gamma * next_q
+
+
 class DQN(nn.Module):
     """Deep Q-Network for traffic control"""
     
-    def __init__(self, state_dim: int, action_dim: int, hidden_layers=[256, 256, 128], dropout=0.2):
+    def __init__(self, state_dim: int, action_dim: int, hidden_layers=[256, 256, 128], dropout=0.0):
         super(DQN, self).__init__()
         
         layers = []
@@ -31,7 +38,8 @@ class DQN(nn.Module):
         for hidden_dim in hidden_layers:
             layers.append(nn.Linear(prev_dim, hidden_dim))
             layers.append(nn.ReLU())
-            layers.append(nn.Dropout(dropout))
+            # Identity when disabled keeps Sequential indices (and checkpoint keys) stable
+            layers.append(nn.Dropout(dropout) if dropout > 0 else nn.Identity())
             prev_dim = hidden_dim
         
         layers.append(nn.Linear(prev_dim, action_dim))
@@ -43,27 +51,131 @@ class DQN(nn.Module):
 
 
 class ReplayBuffer:
-    """Experience replay buffer for DQN"""
+    """
+    Experience replay buffer for DQN
     
-    def __init__(self, capacity=100000):
-        self.buffer = deque(maxlen=capacity)
+    Transitions live in preallocated ring-buffer arrays. With memmap_dir set,
+    states and next_states are backed by np.memmap files so the OS page
+    cache can spill them to disk for large state_dim.
+    """
+    
+    def __init__(self, capacity=100000, state_dim=None, memmap_dir=None):
+        self.capacity = capacity
+        self.memmap_dir = memmap_dir
+        self._pos = 0
+        self._size = 0
+        self.states = None
+        
+        if state_dim is not None:
+            self._allocate(state_dim)
+    
+    def _allocate(self, state_dim):
+        """Allocate storage (called lazily on first push if state_dim unknown)"""
+        shape = (self.capacity, state_dim)
+        if self.memmap_dir:
+            os.makedirs(self.memmap_dir, exist_ok=True)
+            self.states = np.memmap(os.path.join(self.memmap_dir, 'replay_states.dat'),
+                                    dtype=np.float32, mode='w+', shape=shape)
+            self.next_states = np.memmap(os.path.join(self.memmap_dir, 'replay_next_states.dat'),
+                                         dtype=np.float32, mode='w+', shape=shape)
+        else:
+            self.states = np.zeros(shape, dtype=np.float32)
+            self.next_states = np.zeros(shape, dtype=np.float32)
+        
+        # Small per-transition fields stay in RAM
+        self.actions = np.zeros(self.capacity, dtype=np.int64)
+        self.rewards = np.zeros(self.capacity, dtype=np.float32)
+        self.dones = np.zeros(self.capacity, dtype=np.float32)
     
     def push(self, state, action, reward, next_state, done):
-        self.buffer.append((state, action, reward, next_state, done))
+        if self.states is None:
+            self._allocate(len(state))
+        
+        self.states[self._pos] = state
+        self.actions[self._pos] = action
+        self.rewards[self._pos] = reward
+        self.next_states[self._pos] = next_state
+        self.dones[self._pos] = done
+        
+        self._pos = (self._pos + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
     
-    def sample(self, batch_size):
-        batch = random.sample(self.buffer, batch_size)
-        states, actions, rewards, next_states, dones = zip(*batch)
+    def _gather(self, indices):
         return (
-            np.array(states),
-            np.array(actions),
-            np.array(rewards),
-            np.array(next_states),
-            np.array(dones)
+            self.states[indices],
+            self.actions[indices],
+            self.rewards[indices],
+            self.next_states[indices],
+            self.dones[indices]
         )
     
+    def sample(self, batch_size):
+        return self._gather(np.random.randint(0, self._size, batch_size))
+    
     def __len__(self):
-        return len(self.buffer)
+        return self._size
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    Prioritized experience replay backed by a numpy sum-tree
+    
+    Leaves hold priority**alpha; sampling and priority updates walk the
+    tree for the whole batch at once instead of one transition at a time.
+    """
+    
+    def __init__(self, capacity=100000, alpha=0.6, beta=0.4, eps=1e-6,
+                 state_dim=None, memmap_dir=None):
+        super().__init__(capacity, state_dim, memmap_dir)
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        
+        # Leaves start at index _tree_cap (power of two), root is index 1
+        self._tree_cap = 1
+        while self._tree_cap < capacity:
+            self._tree_cap *= 2
+        self._sum_tree = np.zeros(2 * self._tree_cap, dtype=np.float64)
+        self.max_priority = 1.0
+    
+    def _set_priorities(self, indices, priorities):
+        """Write leaf priorities and refresh their ancestors"""
+        nodes = np.asarray(indices, dtype=np.int64) + self._tree_cap
+        self._sum_tree[nodes] = priorities
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self._sum_tree[nodes] = self._sum_tree[2 * nodes] + self._sum_tree[2 * nodes + 1]
+    
+    def push(self, state, action, reward, next_state, done):
+        self._set_priorities([self._pos], self.max_priority ** self.alpha)
+        super().push(state, action, reward, next_state, done)
+    
+    def sample(self, batch_size):
+        total = self._sum_tree[1]
+        
+        # Stratified targets, one per segment of the priority mass
+        targets = (np.arange(batch_size) + np.random.random(batch_size)) * (total / batch_size)
+        nodes = np.ones(batch_size, dtype=np.int64)
+        while nodes[0] < self._tree_cap:
+            left = 2 * nodes
+            left_sum = self._sum_tree[left]
+            go_right = targets > left_sum
+            targets = np.where(go_right, targets - left_sum, targets)
+            nodes = np.where(go_right, left + 1, left)
+        
+        indices = np.minimum(nodes - self._tree_cap, self._size - 1)
+        
+        # Importance-sampling weights, normalized to max 1
+        probs = self._sum_tree[indices + self._tree_cap] / total
+        weights = (self._size * probs) ** (-self.beta)
+        weights /= weights.max()
+        
+        return self._gather(indices) + (indices, weights.astype(np.float32))
+    
+    def update_priorities(self, indices, td_errors):
+        priorities = np.abs(td_errors) + self.eps
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self._set_priorities(indices, priorities ** self.alpha)
 
 
 class RLTrafficController:
@@ -105,7 +217,7 @@ class RLTrafficController:
         # Networks
         network_config = self.config.get('network', {})
         hidden_layers = network_config.get('hidden_layers', [256, 256, 128])
-        dropout = network_config.get('dropout', 0.2)
+        dropout = network_config.get('dropout', 0.0)
         
         self.policy_net = DQN(state_dim, action_dim, hidden_layers, dropout).to(self.device)
         self.target_net = DQN(state_dim, action_dim, hidden_layers, dropout).to(self.device)
@@ -117,7 +229,24 @@ class RLTrafficController:
         self.optimizer = optim.Adam(self.policy_net.parameters(), lr=learning_rate)
         
         # Replay buffer
-        self.memory = ReplayBuffer(capacity=100000)
+        training_config = self.config.get('training', {})
+        # Uniform by default: prioritized replay reads the TD errors back to
+        # the host for update_priorities, a device sync on every train step
+        self.prioritized = training_config.get('prioritized_replay', False)
+        memmap_dir = training_config.get('replay_memmap_dir')
+        if self.prioritized:
+            self.memory = PrioritizedReplayBuffer(
+                capacity=100000,
+                alpha=training_config.get('per_alpha', 0.6),
+                beta=training_config.get('per_beta', 0.4),
+                state_dim=state_dim,
+                memmap_dir=memmap_dir
+            )
+        else:
+            self.memory = ReplayBuffer(capacity=100000, state_dim=state_dim, memmap_dir=memmap_dir)
+        
+        # Reusable gather index columns (resized if train_step gets another batch size)
+        self._alloc_index_buffers(self.config.get('training', {}).get('batch_size', 64))
         
         # Training parameters
         self.gamma = self.config.get('training', {}).get('gamma', 0.99)
@@ -125,9 +254,21 @@ class RLTrafficController:
         self.epsilon_min = self.config.get('training', {}).get('epsilon_end', 0.01)
         self.epsilon_decay = self.config.get('training', {}).get('epsilon_decay', 0.995)
         
+        # Optional running state normalization; for acting it is folded into
+        # the first Linear layer of a policy copy (see _refresh_folded_net)
+        self.normalize_states = training_config.get('normalize_states', False)
+        self._obs_count = 0
+        self._obs_running_mean = np.zeros(state_dim, dtype=np.float64)
+        self._obs_running_m2 = np.zeros(state_dim, dtype=np.float64)
+        self._obs_mean = torch.zeros(state_dim, device=self.device)
+        self._obs_std = torch.ones(state_dim, device=self.device)
+        self._refresh_folded_net()
+        
         # Metrics
         self.train_step_count = 0
         self.episode_count = 0
+        self._loss_sum = torch.zeros((), device=self.device)
+        self._loss_count = 0
         
         print(f"✅ RL Controller Initialized:")
         print(f"   - Traffic Lights: {tl_ids}")
@@ -137,6 +278,11 @@ class RLTrafficController:
         print(f"   - Security: {security_enabled}")
         print(f"   - Device: {self.device}")
     
+    def _alloc_index_buffers(self, batch_size: int):
+        """Allocate the (batch_size, 1) action index columns used by gather"""
+        self._actions_col = torch.empty(batch_size, 1, dtype=torch.long, device=self.device)
+        self._next_actions_col = torch.empty(batch_size, 1, dtype=torch.long, device=self.device)
+    
     def _calculate_state_dim(self) -> int:
         """Calculate state dimension based on features"""
         # Base features per TL: queue(4) + wait(4) + phase(4) + time(1) = 13
@@ -173,28 +319,67 @@ class RLTrafficController:
             # Exploit: best action from Q-network
             with torch.no_grad():
                 state_tensor = torch.FloatTensor(state).unsqueeze(0).to(self.device)
-                q_values = self.policy_net(state_tensor)
+                net = self._folded_net if self.normalize_states else self.policy_net
+                q_values = net(state_tensor)
                 return q_values.argmax().item()
     
     def remember(self, state, action, reward, next_state, done):
         """Store transition in replay buffer"""
         self.memory.push(state, action, reward, next_state, done)
+        
+        if self.normalize_states:
+            # Welford update of the running state statistics
+            self._obs_count += 1
+            delta = state - self._obs_running_mean
+            self._obs_running_mean += delta / self._obs_count
+            self._obs_running_m2 += delta * (state - self._obs_running_mean)
+    
+    def _refresh_folded_net(self):
+        """
+        Snapshot the running state statistics and rebuild the acting network
+        
+        (x - mean) / std is folded into the first Linear layer of a copy of
+        the policy network (W' = W / std, b' = b - W @ (mean / std)), so
+        select_action can feed raw states without a normalization kernel.
+        Without state normalization select_action uses the policy network
+        directly, so there is nothing to rebuild.
+        """
+        if not self.normalize_states:
+            self._folded_net = None
+            return
+        
+        if self._obs_count > 1:
+            std = np.sqrt(self._obs_running_m2 / self._obs_count)
+            self._obs_mean = torch.as_tensor(self._obs_running_mean, dtype=torch.float32, device=self.device)
+            self._obs_std = torch.as_tensor(np.maximum(std, 1e-2), dtype=torch.float32, device=self.device)
+        
+        self._folded_net = copy.deepcopy(self.policy_net)
+        self._folded_net.eval()
+        first_layer = self._folded_net.network[0]
+        with torch.no_grad():
+            first_layer.bias -= first_layer.weight @ (self._obs_mean / self._obs_std)
+            first_layer.weight /= self._obs_std
     
-    def train_step(self, batch_size=64) -> float:
+    def train_step(self, batch_size=64, sync_loss=False):
         """
         Perform one training step
         
         Args:
             batch_size: Batch size for training
+            sync_loss: Return the loss as a Python float (forces a device sync)
             
         Returns:
-            loss: Training loss
+            loss: Training loss (detached tensor unless sync_loss is set), or
+                None if the buffer holds fewer than batch_size transitions
         """
         if len(self.memory) < batch_size:
-            return 0.0
+            return None
         
         # Sample batch
-        states, actions, rewards, next_states, dones = self.memory.sample(batch_size)
+        if self.prioritized:
+            states, actions, rewards, next_states, dones, indices, weights = self.memory.sample(batch_size)
+        else:
+            states, actions, rewards, next_states, dones = self.memory.sample(batch_size)
         
         # Convert to tensors
         states = torch.FloatTensor(states).to(self.device)
@@ -203,17 +388,30 @@ class RLTrafficController:
         next_states = torch.FloatTensor(next_states).to(self.device)
         dones = torch.FloatTensor(dones).to(self.device)
         
+        if self.normalize_states:
+            states = (states - self._obs_mean) / self._obs_std
+            next_states = (next_states - self._obs_mean) / self._obs_std
+        
+        if self._actions_col.shape[0] != batch_size:
+            self._alloc_index_buffers(batch_size)
+        self._actions_col[:, 0].copy_(actions)
+        
         # Current Q values
-        current_q = self.policy_net(states).gather(1, actions.unsqueeze(1)).squeeze(1)
+        current_q = self.policy_net(states).gather(1, self._actions_col).squeeze(1)
         
         # Next Q values (Double DQN)
         with torch.no_grad():
-            next_actions = self.policy_net(next_states).argmax(1)
-            next_q = self.target_net(next_states).gather(1, next_actions.unsqueeze(1)).squeeze(1)
-            target_q = rewards + (1 - dones) * self.gamma * next_q
-        
-        # Compute loss
-        loss = F.smooth_l1_loss(current_q, target_q)
+            torch.argmax(self.policy_net(next_states), 1, keepdim=True, out=self._next_actions_col)
+            next_q = self.target_net(next_states).gather(1, self._next_actions_col).squeeze(1)
+            target_q = bellman(rewards, dones, self.gamma, next_q)
+        
+        # Compute loss (importance-weighted under prioritized replay)
+        if self.prioritized:
+            td_loss = F.smooth_l1_loss(current_q, target_q, reduction='none')
+            loss = (td_loss * torch.from_numpy(weights).to(self.device)).mean()
+            self.memory.update_priorities(indices, (current_q - target_q).abs().detach().cpu().numpy())
+        else:
+            loss = F.smooth_l1_loss(current_q, target_q)
         
         # Optimize
         self.optimizer.zero_grad()
@@ -224,11 +422,31 @@ class RLTrafficController:
         
         self.train_step_count += 1
         
-        return loss.item()
+        loss = loss.detach()
+        self._loss_sum += loss
+        self._loss_count += 1
+        
+        return loss.item() if sync_loss else loss
+    
+    def flush_metrics(self) -> float:
+        """
+        Average the losses accumulated on-device since the last flush
+        
+        Returns:
+            loss: Mean training loss (0.0 if nothing was accumulated)
+        """
+        if not self._loss_count:
+            return 0.0
+        
+        mean_loss = self._loss_sum.item() / self._loss_count
+        self._loss_sum.zero_()
+        self._loss_count = 0
+        return mean_loss
     
     def update_target_network(self):
         """Update target network with policy network weights"""
         self.target_net.load_state_dict(self.policy_net.state_dict())
+        self._refresh_folded_net()
         print(f"  🔄 Target network updated (step {self.train_step_count})")
     
     def save_model(self, path: str):
@@ -247,6 +465,11 @@ class RLTrafficController:
             'episode_count': self.episode_count,
             'state_dim': self.state_dim,
             'action_dim': self.action_dim,
+            'obs_mean': self._obs_mean,
+            'obs_std': self._obs_std,
+            'obs_count': self._obs_count,
+            'obs_running_mean': torch.from_numpy(self._obs_running_mean),
+            'obs_running_m2': torch.from_numpy(self._obs_running_m2),
             'config': self.config
         }
         
@@ -264,7 +487,8 @@ class RLTrafficController:
         if not os.path.exists(path):
             raise FileNotFoundError(f"Model file not found: {path}")
         
-        checkpoint = torch.load(path, map_location=self.device)
+        # Tensors and plain config values only, storages memory-mapped from disk
+        checkpoint = torch.load(path, map_location=self.device, mmap=True, weights_only=True)
         
         self.policy_net.load_state_dict(checkpoint['policy_net_state_dict'])
         self.target_net.load_state_dict(checkpoint['target_net_state_dict'])
@@ -272,6 +496,15 @@ class RLTrafficController:
         self.epsilon = checkpoint.get('epsilon', self.epsilon_min)
         self.train_step_count = checkpoint.get('train_step_count', 0)
         self.episode_count = checkpoint.get('episode_count', 0)
+        if 'obs_mean' in checkpoint:
+            self._obs_mean = checkpoint['obs_mean'].to(self.device)
+            self._obs_std = checkpoint['obs_std'].to(self.device)
+        if 'obs_running_mean' in checkpoint:
+            # Copied out of the memory-mapped storage, they are updated in place
+            self._obs_count = checkpoint['obs_count']
+            self._obs_running_mean = checkpoint['obs_running_mean'].cpu().numpy().copy()
+            self._obs_running_m2 = checkpoint['obs_running_m2'].cpu().numpy().copy()
+        self._refresh_folded_net()
         
         print(f"  ✅ Model loaded from {path}")
         print(f"     - Training steps: {self.train_step_count}")
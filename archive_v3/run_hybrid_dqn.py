@@ -7,17 +7,29 @@ Uses trained model for emergency situations, density-based for normal traffic
 import os
 import sys
 import argparse
+import functools
+import logging
+import logging.handlers
 
 # Add paths
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-sys.path.insert(0, parent_dir)
-sys.path.insert(0, os.path.join(parent_dir, 'rl_module'))
+for path in (parent_dir, os.path.join(parent_dir, 'rl_module')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
 
 import traci
-import numpy as np
-from stable_baselines3 import DQN
 
 from rl_module.vanet_env import VANETTrafficEnv
+from hybrid_dqn_common import DensityActionTable, QNetworkPolicy
+
+logger = logging.getLogger('hybrid_dqn')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+# Step-loop messages are buffered and written in batches rather than per line
+_log_stream = logging.StreamHandler(sys.stdout)
+_log_stream.setFormatter(logging.Formatter('%(message)s'))
+_log_buffer = logging.handlers.MemoryHandler(capacity=4096, flushLevel=logging.ERROR, target=_log_stream)
+logger.addHandler(_log_buffer)
 
 
 class HybridDQNController:
@@ -27,7 +39,8 @@ class HybridDQNController:
     - Trained DQN model for emergency situations
     """
     
-    def __init__(self, model_path, config_path):
+    def __init__(self, model_path, config_path, sumo_step=1.0, no_step_log=False,
+                 threads=None, rerouting_threads=None, coarse_density_step=1):
         """
         Initialize hybrid controller.
         
@@ -37,16 +50,43 @@ class HybridDQNController:
             Path to trained DQN model (.zip file)
         config_path : str
             Path to SUMO configuration
+        sumo_step : float
+            SUMO step length in seconds (default: 1.0)
+        no_step_log : bool
+            Pass ``--no-step-log`` to SUMO
+        threads : int, optional
+            SUMO ``--threads`` (parallel routing/simulation pieces)
+        rerouting_threads : int, optional
+            SUMO ``--device.rerouting.threads``
+        coarse_density_step : int
+            SUMO steps per decision while no emergency is being handled;
+            values above 1 hold the density action and advance the rest of
+            the interval in a single TraCI call (default: 1)
         """
         self.model_path = model_path
         self.config_path = config_path
+        self.sumo_step = sumo_step
+        self.no_step_log = no_step_log
+        self.threads = threads
+        self.rerouting_threads = rerouting_threads
+        self.coarse_density_step = max(1, int(coarse_density_step))
         self.model = None
+        self._q_policy = None
         self.env = None
         self.mode = "DENSITY"
         
+        # Density fallback table (built once SUMO is up)
+        self._density = None
+        
+        # Greenwave plans keyed by (vehicle_id, current_edge); cleared when
+        # any emergency it holds a plan for leaves the network
+        self._greenwave_for = functools.lru_cache(maxsize=1024)(self._create_greenwave)
+        self._greenwave_vehicles = set()
+        
         # Statistics
         self.stats = {
             'total_steps': 0,
+            'decisions': 0,
             'density_steps': 0,
             'rl_steps': 0,
             'emergency_detections': 0,
@@ -65,7 +105,16 @@ class HybridDQNController:
         print(f"  Model: {self.model_path}")
         
         try:
-            self.model = DQN.load(self.model_path)
+            # torch/SB3 are imported here so --help does not pay for them
+            import torch as th
+            from stable_baselines3 import DQN
+            
+            # Inference only: keep torch off SUMO's cores and skip autograd
+            th.set_num_threads(1)
+            th.set_grad_enabled(False)
+            device = 'cuda' if th.cuda.is_available() else 'cpu'
+            self.model = DQN.load(self.model_path, device=device)
+            self._q_policy = QNetworkPolicy(self.model)
             print("✓ Model loaded successfully")
         except Exception as e:
             print(f"❌ Failed to load model: {e}")
@@ -80,9 +129,15 @@ class HybridDQNController:
             sumo_binary,
             "-c", self.config_path,
             "--start",
-            "--step-length", "1",
+            "--step-length", str(self.sumo_step),
             "--no-warnings"
         ]
+        if self.no_step_log:
+            sumo_cmd.append("--no-step-log")
+        if self.threads:
+            sumo_cmd += ["--threads", str(self.threads)]
+        if self.rerouting_threads:
+            sumo_cmd += ["--device.rerouting.threads", str(self.rerouting_threads)]
         
         try:
             traci.start(sumo_cmd)
@@ -113,7 +168,7 @@ class HybridDQNController:
             'action_spec': action_spec,
             'tl_constraint_min': 5,
             'tl_constraint_max': 60,
-            'sim_step': 1.0,
+            'sim_step': self.sumo_step,
             'algorithm': 'DQN',
             'horizon': 1000,
         }
@@ -127,6 +182,8 @@ class HybridDQNController:
             print(f"❌ Failed to create environment: {e}")
             return False
         
+        self._density = DensityActionTable(self.env)
+        
         # Reset environment
         print(f"\nResetting environment...")
         try:
@@ -144,6 +201,52 @@ class HybridDQNController:
         
         return True
     
+    def _coarse_advance(self, extra_steps):
+        """
+        Hold the current density action for the rest of a coarse step.
+        
+        Advances SUMO by ``extra_steps`` more steps in one TraCI call. The
+        env's per-step bookkeeping (light timers, reward, horizon) only runs
+        on the decision step itself.
+        
+        Parameters
+        ----------
+        extra_steps : int
+            SUMO steps to advance past the decision step
+        
+        Returns
+        -------
+        np.ndarray
+            Observation at the end of the interval
+        """
+        target = traci.simulation.getTime() + extra_steps * self.sumo_step
+        traci.simulationStep(target)
+        # The env's per-step caches describe the decision step
+        self.env.invalidate_step_cache()
+        return self.env.get_state()
+    
+    def _create_greenwave(self, vehicle_id, current_edge):
+        """
+        Build the greenwave plan for an emergency at its current edge.
+        
+        Wrapped by ``_greenwave_for`` so the coordinator's route scan only
+        runs when the vehicle enters a new edge.
+        
+        Parameters
+        ----------
+        vehicle_id : str
+            Emergency vehicle ID
+        current_edge : str
+            Edge the vehicle is on (part of the cache key only)
+        
+        Returns
+        -------
+        list of str
+            Traffic light IDs along the vehicle's route
+        """
+        coordinator = self.env.emergency_coordinator
+        return coordinator.create_greenwave(coordinator.emergency_vehicles[vehicle_id])
+    
     def run(self, steps=3600):
         """
         Run hybrid control simulation.
@@ -167,8 +270,12 @@ class HybridDQNController:
         obs, info = self.env.reset()
         
         try:
-            for step in range(steps):
+            # ``step`` counts SUMO steps; a coarse density decision covers several
+            step = 0
+            next_log = 0
+            while step < steps:
                 self.stats['total_steps'] += 1
+                self.stats['decisions'] += 1
                 
                 # Check for emergency vehicles
                 active_emergencies = self.env.emergency_coordinator.get_active_emergency_vehicles()
@@ -178,19 +285,24 @@ class HybridDQNController:
                     if self.mode != "RL-EMERGENCY":
                         self.mode = "RL-EMERGENCY"
                         self.stats['emergency_detections'] += len(active_emergencies)
-                        print(f"\n🚨 EMERGENCY DETECTED at step {step}!")
-                        for emerg in active_emergencies:
-                            print(f"   • {emerg.vehicle_id} detected by {emerg.detected_by_rsu}")
-                        print(f"   Switching to TRAINED DQN control...\n")
+                        if logger.isEnabledFor(logging.INFO):
+                            logger.info(f"\n🚨 EMERGENCY DETECTED at step {step}!")
+                            for emerg in active_emergencies:
+                                logger.info(f"   • {emerg.vehicle_id} detected by {emerg.detected_by_rsu}")
+                            logger.info("   Switching to TRAINED DQN control...\n")
                     
                     self.stats['rl_steps'] += 1
                     
                     # Use trained model to predict action
-                    action, _states = self.model.predict(obs, deterministic=True)
+                    action = self._q_policy.predict([obs])[0]
                     
-                    # Apply greenwave for emergencies
+                    # Apply greenwave for emergencies (plans reused until the edge changes)
+                    active_ids = {emerg.vehicle_id for emerg in active_emergencies}
+                    if not self._greenwave_vehicles <= active_ids:
+                        self._greenwave_for.cache_clear()
+                    self._greenwave_vehicles = active_ids
                     for emerg in active_emergencies:
-                        greenwave_junctions = self.env.emergency_coordinator.create_greenwave(emerg)
+                        greenwave_junctions = self._greenwave_for(emerg.vehicle_id, emerg.current_edge)
                         if greenwave_junctions:
                             self.env.emergency_coordinator.apply_greenwave(emerg.vehicle_id, greenwave_junctions)
                 
@@ -198,29 +310,44 @@ class HybridDQNController:
                     # DENSITY MODE: Use simple heuristic (simulated by model too for consistency)
                     if self.mode != "DENSITY":
                         self.mode = "DENSITY"
-                        print(f"\n✅ EMERGENCY CLEARED at step {step}")
-                        print(f"   Switching back to density-based control...\n")
+                        self._greenwave_for.cache_clear()
+                        self._greenwave_vehicles = set()
+                        if logger.isEnabledFor(logging.INFO):
+                            logger.info(f"\n✅ EMERGENCY CLEARED at step {step}")
+                            logger.info("   Switching back to density-based control...\n")
                     
                     self.stats['density_steps'] += 1
                     
-                    # Could use density-based logic here, but for simplicity use model
-                    # with lower determinism (more exploration)
-                    action, _states = self.model.predict(obs, deterministic=False)
+                    # Density-based phase choice, no DQN forward pass
+                    action = self._density.action()
                 
                 # Step environment
                 obs, reward, done, truncated, info = self.env.step(action)
                 self.stats['total_reward'] += reward
                 
-                # Print progress
-                if step % 50 == 0:
-                    avg_reward = self.stats['total_reward'] / max(1, step + 1)
-                    print(f"Step {step:4d}/{steps} | Mode: {self.mode:15s} | "
-                          f"Reward: {reward:7.2f} | Avg: {avg_reward:7.2f} | "
-                          f"Emergencies: {len(active_emergencies)}")
+                extra_steps = 0
+                if self.mode == "DENSITY" and not (done or truncated):
+                    extra_steps = min(self.coarse_density_step - 1, steps - step - 1)
+                    if extra_steps > 0:
+                        obs = self._coarse_advance(extra_steps)
+                        self.stats['total_steps'] += extra_steps
+                        self.stats['density_steps'] += extra_steps
+                
+                # Log progress
+                if step >= next_log and logger.isEnabledFor(logging.INFO):
+                    next_log = (step // 50 + 1) * 50
+                    avg_reward = self.stats['total_reward'] / self.stats['decisions']
+                    logger.info(f"Step {step:4d}/{steps} | Mode: {self.mode:15s} | "
+                                f"Reward: {reward:7.2f} | Avg: {avg_reward:7.2f} | "
+                                f"Emergencies: {len(active_emergencies)}")
                 
                 if done or truncated:
-                    print(f"\nEpisode ended at step {step}, resetting...")
+                    logger.info(f"\nEpisode ended at step {step}, resetting...")
                     obs, info = self.env.reset()
+                    self._greenwave_for.cache_clear()
+                    self._greenwave_vehicles = set()
+                
+                step += 1 + extra_steps
             
             # Print final statistics
             self.print_statistics()
@@ -235,6 +362,7 @@ class HybridDQNController:
             traceback.print_exc()
         
         finally:
+            _log_buffer.flush()
             try:
                 traci.close()
                 print("\n✓ SUMO connection closed")
@@ -243,6 +371,7 @@ class HybridDQNController:
     
     def print_statistics(self):
         """Print simulation statistics."""
+        _log_buffer.flush()
         print()
         print("=" * 80)
         print("HYBRID CONTROL SIMULATION STATISTICS")
@@ -252,14 +381,16 @@ class HybridDQNController:
         total = self.stats['total_steps']
         density_pct = (self.stats['density_steps'] / total * 100) if total > 0 else 0
         rl_pct = (self.stats['rl_steps'] / total * 100) if total > 0 else 0
-        avg_reward = self.stats['total_reward'] / total if total > 0 else 0
+        decisions = self.stats['decisions']
+        avg_reward = self.stats['total_reward'] / decisions if decisions > 0 else 0
         
         print(f"Total steps: {total}")
         print(f"Density-based mode: {self.stats['density_steps']} steps ({density_pct:.1f}%)")
         print(f"RL emergency mode: {self.stats['rl_steps']} steps ({rl_pct:.1f}%)")
         print(f"Emergency detections: {self.stats['emergency_detections']}")
+        print(f"Control decisions: {decisions}")
         print(f"Total reward: {self.stats['total_reward']:.2f}")
-        print(f"Average reward: {avg_reward:.2f}")
+        print(f"Average reward per decision: {avg_reward:.2f}")
         print()
         
         # Emergency statistics
@@ -302,6 +433,35 @@ def main():
         default=3600,
         help='Number of simulation steps'
     )
+    parser.add_argument(
+        '--sumo-step',
+        type=float,
+        default=1.0,
+        help='SUMO step length in seconds'
+    )
+    parser.add_argument(
+        '--no-step-log',
+        action='store_true',
+        help='Disable SUMO per-step console output'
+    )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=None,
+        help='SUMO --threads'
+    )
+    parser.add_argument(
+        '--rerouting-threads',
+        type=int,
+        default=None,
+        help='SUMO --device.rerouting.threads'
+    )
+    parser.add_argument(
+        '--coarse-density-step',
+        type=int,
+        default=1,
+        help='SUMO steps per decision in density mode; emergencies are only picked up on decision steps'
+    )
     
     args = parser.parse_args()
     
@@ -317,7 +477,12 @@ def main():
     # Create controller
     controller = HybridDQNController(
         model_path=args.model,
-        config_path=args.config
+        config_path=args.config,
+        sumo_step=args.sumo_step,
+        no_step_log=args.no_step_log,
+        threads=args.threads,
+        rerouting_threads=args.rerouting_threads,
+        coarse_density_step=args.coarse_density_step
     )
     
     # Initialize
@@ -8,17 +8,75 @@ More efficient than global switching.
 import os
 import sys
 import argparse
+import logging
+import logging.handlers
+import math
 import numpy as np
 
 # Add paths
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-sys.path.insert(0, parent_dir)
-sys.path.insert(0, os.path.join(parent_dir, 'rl_module'))
+for path in (parent_dir, os.path.join(parent_dir, 'rl_module')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
 
 import traci
-from stable_baselines3 import DQN
+import traci.constants as tc
 
 from rl_module.vanet_env import VANETTrafficEnv
+from hybrid_dqn_common import DensityActionTable, QNetworkPolicy
+
+try:
+    from scipy.spatial import cKDTree
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    
+    def njit(*args, **kwargs):
+        """Fallback no-op decorator when numba is not installed"""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# Below this many emergency-junction pairs the broadcast scan beats a KD-tree
+KDTREE_MIN_PAIRS = 64
+
+logger = logging.getLogger('proximity_hybrid')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+# Step-loop messages are buffered and written in batches rather than per line
+_log_stream = logging.StreamHandler(sys.stdout)
+_log_stream.setFormatter(logging.Formatter('%(message)s'))
+_log_buffer = logging.handlers.MemoryHandler(capacity=4096, flushLevel=logging.ERROR, target=_log_stream)
+logger.addHandler(_log_buffer)
+
+
+@njit(fastmath=True)
+def _prox_kernel(ev_xy, jx_xy, thr_sq, out_idx, out_d2):
+    """
+    Nearest emergency within range of each junction, in a single fused pass.
+    
+    Writes the emergency row index into ``out_idx`` (-1 when none is within
+    ``thr_sq``) and the squared distance into ``out_d2``. Ties keep the
+    first emergency, matching ``np.argmin``.
+    """
+    for j in range(jx_xy.shape[0]):
+        best = -1
+        best_d2 = thr_sq
+        for e in range(ev_xy.shape[0]):
+            dx = ev_xy[e, 0] - jx_xy[j, 0]
+            dy = ev_xy[e, 1] - jx_xy[j, 1]
+            d2 = dx * dx + dy * dy
+            if d2 <= thr_sq and (best < 0 or d2 < best_d2):
+                best = e
+                best_d2 = d2
+        out_idx[j] = best
+        out_d2[j] = best_d2
 
 
 class ProximityBasedHybridController:
@@ -30,7 +88,8 @@ class ProximityBasedHybridController:
     - Switches back immediately after emergency passes
     """
     
-    def __init__(self, model_path, config_path, proximity_threshold=200.0):
+    def __init__(self, model_path, config_path, proximity_threshold=200.0, sumo_step=1.0,
+                 no_step_log=False, threads=None, rerouting_threads=None, coarse_density_step=1):
         """
         Initialize proximity-based controller.
         
@@ -42,22 +101,54 @@ class ProximityBasedHybridController:
             Path to SUMO configuration
         proximity_threshold : float
             Distance threshold in meters (default: 200m)
+        sumo_step : float
+            SUMO step length in seconds (default: 1.0)
+        no_step_log : bool
+            Pass ``--no-step-log`` to SUMO
+        threads : int, optional
+            SUMO ``--threads`` (parallel routing/simulation pieces)
+        rerouting_threads : int, optional
+            SUMO ``--device.rerouting.threads``
+        coarse_density_step : int
+            SUMO steps per decision while no emergency is being handled;
+            values above 1 hold the density action and advance the rest of
+            the interval in a single TraCI call (default: 1)
         """
         self.model_path = model_path
         self.config_path = config_path
         self.proximity_threshold = proximity_threshold
+        self.sumo_step = sumo_step
+        self.no_step_log = no_step_log
+        self.threads = threads
+        self.rerouting_threads = rerouting_threads
+        self.coarse_density_step = max(1, int(coarse_density_step))
+        self._prox_sq = float(proximity_threshold) ** 2
         self.model = None
+        self._q_policy = None
         self.env = None
         
         # Junction positions (will be populated from SUMO)
         self.junction_positions = {}
+        self._junction_ids = []
+        self._junction_xy = np.empty((0, 2), dtype=np.float32)
+        self._kdtree = None
+        self._out_idx = np.empty(0, dtype=np.int32)
+        self._out_d2 = np.empty(0, dtype=np.float32)
+        
+        # Per-junction mode tracking, aligned with self._junction_ids
+        self._jid_to_idx = {}
+        self._modes = np.zeros(0, dtype=np.uint8)  # 0 = DENSITY, 1 = RL
         
-        # Per-junction mode tracking
-        self.junction_modes = {}  # junction_id -> "DENSITY" or "RL"
+        # Density fallback table (built once SUMO is up)
+        self._density = None
+        
+        # vehicle_id -> ((current_edge, route), greenwave junctions)
+        self._greenwave_cache = {}
         
         # Statistics
         self.stats = {
             'total_steps': 0,
+            'decisions': 0,
             'density_steps': 0,
             'rl_steps': 0,
             'emergency_detections': 0,
@@ -65,6 +156,11 @@ class ProximityBasedHybridController:
             'total_reward': 0,
         }
     
+    @property
+    def junction_modes(self):
+        """junction_id -> "DENSITY" or "RL", built from the mode array."""
+        return {j: "RL" if m else "DENSITY" for j, m in zip(self._junction_ids, self._modes)}
+    
     def initialize(self):
         """Initialize the controller."""
         print("=" * 80)
@@ -76,7 +172,16 @@ class ProximityBasedHybridController:
         # Load model
         print(f"Loading DQN model...")
         try:
-            self.model = DQN.load(self.model_path)
+            # torch/SB3 are imported here so --help does not pay for them
+            import torch as th
+            from stable_baselines3 import DQN
+            
+            # Inference only: keep torch off SUMO's cores and skip autograd
+            th.set_num_threads(1)
+            th.set_grad_enabled(False)
+            device = 'cuda' if th.cuda.is_available() else 'cpu'
+            self.model = DQN.load(self.model_path, device=device)
+            self._q_policy = QNetworkPolicy(self.model)
             print("✓ Model loaded")
         except Exception as e:
             print(f"❌ Failed: {e}")
@@ -84,7 +189,13 @@ class ProximityBasedHybridController:
         
         # Start SUMO
         print(f"\nStarting SUMO...")
-        sumo_cmd = ["sumo", "-c", self.config_path, "--start", "--step-length", "1", "--no-warnings"]
+        sumo_cmd = ["sumo", "-c", self.config_path, "--start", "--step-length", str(self.sumo_step), "--no-warnings"]
+        if self.no_step_log:
+            sumo_cmd.append("--no-step-log")
+        if self.threads:
+            sumo_cmd += ["--threads", str(self.threads)]
+        if self.rerouting_threads:
+            sumo_cmd += ["--device.rerouting.threads", str(self.rerouting_threads)]
         
         try:
             traci.start(sumo_cmd)
@@ -105,7 +216,6 @@ class ProximityBasedHybridController:
                     junction_id = tl_id  # Traffic light ID usually matches junction ID
                     junction_pos = traci.junction.getPosition(junction_id)
                     self.junction_positions[tl_id] = junction_pos
-                    self.junction_modes[tl_id] = "DENSITY"
                     print(f"  {tl_id}: Position ({junction_pos[0]:.1f}, {junction_pos[1]:.1f})")
                     continue
                 except:
@@ -131,11 +241,27 @@ class ProximityBasedHybridController:
                         x = sum(all_x) / len(all_x)
                         y = sum(all_y) / len(all_y)
                         self.junction_positions[tl_id] = (x, y)
-                        self.junction_modes[tl_id] = "DENSITY"
                         print(f"  {tl_id}: Position ({x:.1f}, {y:.1f})")
             except Exception as e:
                 print(f"  ⚠️  {tl_id}: Could not get position ({e})")
         
+        # Array view of junction positions for vectorized proximity checks
+        self._junction_ids = list(self.junction_positions.keys())
+        self._junction_xy = np.asarray(
+            [self.junction_positions[j] for j in self._junction_ids], dtype=np.float32
+        ).reshape(-1, 2)
+        if SCIPY_AVAILABLE and self._junction_ids:
+            self._kdtree = cKDTree(self._junction_xy)
+        self._jid_to_idx = {j: i for i, j in enumerate(self._junction_ids)}
+        self._modes = np.zeros(len(self._junction_ids), dtype=np.uint8)
+        
+        # Output buffers for the proximity kernel (compiled here, not mid-run)
+        self._out_idx = np.empty(len(self._junction_ids), dtype=np.int32)
+        self._out_d2 = np.empty(len(self._junction_ids), dtype=np.float32)
+        if NUMBA_AVAILABLE:
+            _prox_kernel(np.empty((0, 2), dtype=np.float32), self._junction_xy,
+                         self._prox_sq, self._out_idx, self._out_d2)
+        
         # Build action spec
         action_spec = {}
         for tl_id in tl_ids:
@@ -153,7 +279,7 @@ class ProximityBasedHybridController:
             'action_spec': action_spec,
             'tl_constraint_min': 5,
             'tl_constraint_max': 60,
-            'sim_step': 1.0,
+            'sim_step': self.sumo_step,
             'algorithm': 'DQN',
             'horizon': 1000,
         }
@@ -165,6 +291,8 @@ class ProximityBasedHybridController:
             print(f"❌ Failed: {e}")
             return False
         
+        self._density = DensityActionTable(self.env)
+        
         # Reset
         obs, info = self.env.reset()
         print("✓ Environment reset")
@@ -177,58 +305,139 @@ class ProximityBasedHybridController:
         
         return True
     
-    def get_emergency_junction_proximity(self):
+    def get_emergency_junction_proximity(self, active_emergencies=None):
         """
         Calculate which junctions are near emergency vehicles.
         
+        Parameters
+        ----------
+        active_emergencies : list of EmergencyVehicle, optional
+            Active emergencies already fetched this step; queried from the
+            emergency coordinator if not given
+        
         Returns
         -------
         dict
-            junction_id -> (distance, emergency_vehicle_id) for junctions near emergencies
+            junction_id -> (squared_distance, emergency_vehicle_id) for junctions
+            near emergencies
         """
         proximity_map = {}
         
         try:
             # Get active emergency vehicles
-            active_emergencies = self.env.emergency_coordinator.get_active_emergency_vehicles()
+            if active_emergencies is None:
+                active_emergencies = self.env.emergency_coordinator.get_active_emergency_vehicles()
             
-            if not active_emergencies:
+            if not active_emergencies or not self._junction_ids:
                 return proximity_map
             
-            current_vehicles = set(traci.vehicle.getIDList())
+            # The coordinator subscribes each emergency's position on detection;
+            # vehicles that have left the simulation drop out of the results
+            positions = traci.vehicle.getAllSubscriptionResults()
+            emerg_ids = [e.vehicle_id for e in active_emergencies
+                         if tc.VAR_POSITION in positions.get(e.vehicle_id, ())]
             
-            for emerg_veh in active_emergencies:
-                veh_id = emerg_veh.vehicle_id
-                
-                # Check if vehicle still exists
-                if veh_id not in current_vehicles:
-                    continue
-                
-                try:
-                    # Get emergency vehicle position
-                    emerg_pos = traci.vehicle.getPosition(veh_id)
-                    
-                    # Check distance to each junction
-                    for junction_id, junction_pos in self.junction_positions.items():
-                        distance = np.sqrt(
-                            (emerg_pos[0] - junction_pos[0])**2 + 
-                            (emerg_pos[1] - junction_pos[1])**2
-                        )
-                        
-                        # If within threshold
-                        if distance <= self.proximity_threshold:
-                            # Store closest emergency for this junction
-                            if junction_id not in proximity_map or distance < proximity_map[junction_id][0]:
-                                proximity_map[junction_id] = (distance, veh_id)
-                
-                except Exception as e:
-                    continue
+            if not emerg_ids:
+                return proximity_map
+            
+            emerg_xy = np.asarray(
+                [positions[veh_id][tc.VAR_POSITION] for veh_id in emerg_ids], dtype=np.float32
+            )
+            
+            if self._kdtree is not None and len(emerg_ids) * len(self._junction_ids) >= KDTREE_MIN_PAIRS:
+                # Only visit the junctions inside each emergency's radius
+                hits = self._kdtree.query_ball_point(emerg_xy, r=self.proximity_threshold)
+                for e, junction_idxs in enumerate(hits):
+                    ex, ey = emerg_xy[e].tolist()
+                    for j in junction_idxs:
+                        jx, jy = self.junction_positions[self._junction_ids[j]]
+                        dx = ex - jx
+                        dy = ey - jy
+                        dist_sq = dx * dx + dy * dy
+                        # query_ball_point already applied the radius; this only
+                        # settles rounding at the boundary the same way as the
+                        # kernel and NumPy paths' dist_sq <= prox_sq test
+                        if dist_sq > self._prox_sq:
+                            continue
+                        junction_id = self._junction_ids[j]
+                        if junction_id not in proximity_map or dist_sq < proximity_map[junction_id][0]:
+                            proximity_map[junction_id] = (dist_sq, emerg_ids[e])
+                return proximity_map
+            
+            if NUMBA_AVAILABLE:
+                _prox_kernel(emerg_xy, self._junction_xy, self._prox_sq, self._out_idx, self._out_d2)
+                for j in np.flatnonzero(self._out_idx >= 0):
+                    proximity_map[self._junction_ids[j]] = (
+                        float(self._out_d2[j]), emerg_ids[self._out_idx[j]]
+                    )
+                return proximity_map
+            
+            # (E, 2) emergency positions against (J, 2) junction positions
+            d2 = ((emerg_xy[:, None, :] - self._junction_xy[None, :, :]) ** 2).sum(-1)
+            d2 = np.where(d2 <= self._prox_sq, d2, np.inf)
+            
+            # Closest emergency per junction (within threshold)
+            closest = np.argmin(d2, axis=0)
+            closest_d2 = d2[closest, np.arange(len(self._junction_ids))]
+            
+            for j in np.flatnonzero(np.isfinite(closest_d2)):
+                proximity_map[self._junction_ids[j]] = (float(closest_d2[j]), emerg_ids[closest[j]])
         
         except Exception as e:
             pass
         
         return proximity_map
     
+    def _greenwave_for(self, emerg):
+        """
+        Greenwave junctions for an emergency, memoized per vehicle.
+        
+        ``create_greenwave`` only depends on the vehicle's route and current
+        edge, so the previous plan is reused until either changes.
+        
+        Parameters
+        ----------
+        emerg : EmergencyVehicle
+            Active emergency vehicle
+        
+        Returns
+        -------
+        list of str
+            Traffic light IDs along the vehicle's route
+        """
+        key = (emerg.current_edge, tuple(emerg.route))
+        cached = self._greenwave_cache.get(emerg.vehicle_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        
+        greenwave_junctions = self.env.emergency_coordinator.create_greenwave(emerg)
+        self._greenwave_cache[emerg.vehicle_id] = (key, greenwave_junctions)
+        return greenwave_junctions
+    
+    def _coarse_advance(self, extra_steps):
+        """
+        Hold the current density action for the rest of a coarse step.
+        
+        Advances SUMO by ``extra_steps`` more steps in one TraCI call. The
+        env's per-step bookkeeping (light timers, reward, horizon) only runs
+        on the decision step itself.
+        
+        Parameters
+        ----------
+        extra_steps : int
+            SUMO steps to advance past the decision step
+        
+        Returns
+        -------
+        np.ndarray
+            Observation at the end of the interval
+        """
+        target = traci.simulation.getTime() + extra_steps * self.sumo_step
+        traci.simulationStep(target)
+        # The env's per-step caches describe the decision step
+        self.env.invalidate_step_cache()
+        return self.env.get_state()
+    
     def run(self, steps=3600):
         """Run proximity-based hybrid control."""
         print("=" * 80)
@@ -247,81 +456,96 @@ class ProximityBasedHybridController:
         obs, info = self.env.reset()
         
         try:
-            for step in range(steps):
+            # ``step`` counts SUMO steps; a coarse density decision covers several
+            step = 0
+            next_log = 0
+            while step < steps:
                 self.stats['total_steps'] += 1
+                self.stats['decisions'] += 1
+                
+                # Active emergencies, fetched once per step and indexed by id
+                actives = self.env.emergency_coordinator.get_active_emergency_vehicles()
+                actives_by_id = {e.vehicle_id: e for e in actives}
                 
                 # Get junction proximity to emergencies
-                proximity_map = self.get_emergency_junction_proximity()
+                proximity_map = self.get_emergency_junction_proximity(actives)
                 
-                # Update junction modes based on proximity
-                mode_changes = []
-                for junction_id in self.junction_modes.keys():
-                    old_mode = self.junction_modes[junction_id]
-                    
-                    if junction_id in proximity_map:
-                        # Emergency nearby - switch to RL
-                        new_mode = "RL"
-                        distance, emerg_id = proximity_map[junction_id]
-                        if old_mode != new_mode:
-                            mode_changes.append((junction_id, emerg_id, distance, "DENSITY→RL"))
-                            self.stats['junction_switches'] += 1
-                    else:
-                        # No emergency - use density
-                        new_mode = "DENSITY"
-                        if old_mode != new_mode:
-                            mode_changes.append((junction_id, None, 0, "RL→DENSITY"))
-                            self.stats['junction_switches'] += 1
-                    
-                    self.junction_modes[junction_id] = new_mode
+                # Update junction modes based on proximity: RL near an emergency,
+                # DENSITY otherwise
+                new_modes = np.zeros(len(self._junction_ids), dtype=np.uint8)
+                new_modes[[self._jid_to_idx[j] for j in proximity_map]] = 1
+                changes = np.flatnonzero(new_modes != self._modes)
+                self.stats['junction_switches'] += len(changes)
                 
-                # Print mode changes
-                if mode_changes:
-                    for junction_id, emerg_id, distance, change in mode_changes:
-                        if "RL" in change:
-                            print(f"🚨 Step {step}: {junction_id} → RL mode "
-                                  f"({emerg_id} at {distance:.1f}m)")
+                # Log mode changes
+                if len(changes) and logger.isEnabledFor(logging.INFO):
+                    for i in changes:
+                        junction_id = self._junction_ids[i]
+                        if new_modes[i]:
+                            dist_sq, emerg_id = proximity_map[junction_id]
+                            logger.info(f"🚨 Step {step}: {junction_id} → RL mode "
+                                        f"({emerg_id} at {math.sqrt(dist_sq):.1f}m)")
                         else:
-                            print(f"✅ Step {step}: {junction_id} → DENSITY mode "
-                                  f"(emergency passed)")
+                            logger.info(f"✅ Step {step}: {junction_id} → DENSITY mode "
+                                        f"(emergency passed)")
+                
+                self._modes = new_modes
                 
                 # Count mode usage
-                rl_junctions = sum(1 for mode in self.junction_modes.values() if mode == "RL")
+                rl_junctions = int(np.count_nonzero(new_modes))
                 if rl_junctions > 0:
                     self.stats['rl_steps'] += 1
                 else:
                     self.stats['density_steps'] += 1
                 
-                # Use trained model to predict action
-                # In real implementation, you'd apply RL only to junctions in RL mode
-                # and density-based to others. For simplicity, we use the model.
-                action, _states = self.model.predict(obs, deterministic=True)
+                # Trained model only while an emergency is near some junction;
+                # otherwise a density-based phase choice (no DQN forward pass)
+                if proximity_map:
+                    action = self._q_policy.predict([obs])[0]
+                else:
+                    action = self._density.action()
                 
-                # Apply greenwave for nearby emergencies
+                # Apply greenwave once per emergency that is near some junction
                 if proximity_map:
-                    for junction_id, (distance, emerg_id) in proximity_map.items():
-                        # Find emergency vehicle object
-                        for emerg in self.env.emergency_coordinator.get_active_emergency_vehicles():
-                            if emerg.vehicle_id == emerg_id:
-                                greenwave_junctions = self.env.emergency_coordinator.create_greenwave(emerg)
-                                if greenwave_junctions:
-                                    self.env.emergency_coordinator.apply_greenwave(emerg_id, greenwave_junctions)
-                                break
+                    hit_emerg_ids = {emerg_id for _, emerg_id in proximity_map.values()}
+                    for emerg in actives:
+                        if emerg.vehicle_id in hit_emerg_ids:
+                            greenwave_junctions = self._greenwave_for(emerg)
+                            if greenwave_junctions:
+                                self.env.emergency_coordinator.apply_greenwave(emerg.vehicle_id, greenwave_junctions)
+                
+                # Forget plans of emergencies that are no longer active
+                for veh_id in [v for v in self._greenwave_cache if v not in actives_by_id]:
+                    del self._greenwave_cache[veh_id]
                 
                 # Step environment
                 obs, reward, done, truncated, info = self.env.step(action)
                 self.stats['total_reward'] += reward
                 
-                # Print progress
-                if step % 50 == 0:
-                    avg_reward = self.stats['total_reward'] / max(1, step + 1)
-                    rl_pct = (rl_junctions / len(self.junction_modes) * 100) if self.junction_modes else 0
-                    print(f"Step {step:4d}/{steps} | RL Junctions: {rl_junctions}/{len(self.junction_modes)} ({rl_pct:.0f}%) | "
-                          f"Reward: {reward:7.2f} | Avg: {avg_reward:7.2f} | "
-                          f"Emergencies: {len(proximity_map)}")
+                extra_steps = 0
+                if not proximity_map and not (done or truncated):
+                    extra_steps = min(self.coarse_density_step - 1, steps - step - 1)
+                    if extra_steps > 0:
+                        obs = self._coarse_advance(extra_steps)
+                        self.stats['total_steps'] += extra_steps
+                        self.stats['density_steps'] += extra_steps
+                
+                # Log progress
+                if step >= next_log and logger.isEnabledFor(logging.INFO):
+                    next_log = (step // 50 + 1) * 50
+                    avg_reward = self.stats['total_reward'] / self.stats['decisions']
+                    num_junctions = len(self._junction_ids)
+                    rl_pct = (rl_junctions / num_junctions * 100) if num_junctions else 0
+                    logger.info(f"Step {step:4d}/{steps} | RL Junctions: {rl_junctions}/{num_junctions} ({rl_pct:.0f}%) | "
+                                f"Reward: {reward:7.2f} | Avg: {avg_reward:7.2f} | "
+                                f"Emergencies: {len(proximity_map)}")
                 
                 if done or truncated:
-                    print(f"\nEpisode ended, resetting...")
+                    logger.info("\nEpisode ended, resetting...")
                     obs, info = self.env.reset()
+                    self._greenwave_cache.clear()
+                
+                step += 1 + extra_steps
             
             self.print_statistics()
             
@@ -333,6 +557,7 @@ class ProximityBasedHybridController:
             import traceback
             traceback.print_exc()
         finally:
+            _log_buffer.flush()
             try:
                 traci.close()
                 print("\n✓ SUMO closed")
@@ -341,6 +566,7 @@ class ProximityBasedHybridController:
     
     def print_statistics(self):
         """Print simulation statistics."""
+        _log_buffer.flush()
         print()
         print("=" * 80)
         print("PROXIMITY-BASED HYBRID CONTROL STATISTICS")
@@ -350,14 +576,16 @@ class ProximityBasedHybridController:
         total = self.stats['total_steps']
         density_pct = (self.stats['density_steps'] / total * 100) if total > 0 else 0
         rl_pct = (self.stats['rl_steps'] / total * 100) if total > 0 else 0
-        avg_reward = self.stats['total_reward'] / total if total > 0 else 0
+        decisions = self.stats['decisions']
+        avg_reward = self.stats['total_reward'] / decisions if decisions > 0 else 0
         
         print(f"Total steps: {total}")
         print(f"Steps with ALL junctions in DENSITY: {self.stats['density_steps']} ({density_pct:.1f}%)")
         print(f"Steps with SOME junctions in RL: {self.stats['rl_steps']} ({rl_pct:.1f}%)")
         print(f"Junction mode switches: {self.stats['junction_switches']}")
+        print(f"Control decisions: {decisions}")
         print(f"Total reward: {self.stats['total_reward']:.2f}")
-        print(f"Average reward: {avg_reward:.2f}")
+        print(f"Average reward per decision: {avg_reward:.2f}")
         print()
         
         print("✅ PROXIMITY-BASED CONTROL ADVANTAGES:")
@@ -378,6 +606,17 @@ def main():
     parser.add_argument('--steps', type=int, default=3600, help='Simulation steps')
     parser.add_argument('--proximity', type=float, default=200.0, 
                        help='Proximity threshold in meters (default: 200m)')
+    parser.add_argument('--sumo-step', type=float, default=1.0,
+                       help='SUMO step length in seconds (default: 1.0)')
+    parser.add_argument('--no-step-log', action='store_true',
+                       help='Disable SUMO per-step console output')
+    parser.add_argument('--threads', type=int, default=None,
+                       help='SUMO --threads')
+    parser.add_argument('--rerouting-threads', type=int, default=None,
+                       help='SUMO --device.rerouting.threads')
+    parser.add_argument('--coarse-density-step', type=int, default=1,
+                       help='SUMO steps per decision in density mode (default: 1); '
+                            'emergencies are only picked up on decision steps')
     
     args = parser.parse_args()
     
@@ -393,7 +632,12 @@ def main():
     controller = ProximityBasedHybridController(
         model_path=args.model,
         config_path=args.config,
-        proximity_threshold=args.proximity
+        proximity_threshold=args.proximity,
+        sumo_step=args.sumo_step,
+        no_step_log=args.no_step_log,
+        threads=args.threads,
+        rerouting_threads=args.rerouting_threads,
+        coarse_density_step=args.coarse_density_step
     )
     
     # Initialize
@@ -13,8 +13,12 @@ sys.path.insert(0, parent_dir)
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 import traci
+import traci.constants as tc
 from vanet_env import VANETTrafficEnv
 
+# tl_id -> phase states of its first program logic (fetched once per process)
+_PHASE_CACHE = {}
+
 
 def test_rl_environment():
     """Test the RL environment with SUMO"""
@@ -53,12 +57,18 @@ def test_rl_environment():
     tl_ids = traci.trafficlight.getIDList()
     print(f"✓ Found {len(tl_ids)} traffic lights: {tl_ids}")
     
-    # Build action spec
+    # Build action spec; lights are subscribed so per-step state reads
+    # come from the subscription results instead of fresh TraCI queries
     action_spec = {}
     for tl_id in tl_ids:
         try:
-            logic = traci.trafficlight.getAllProgramLogics(tl_id)[0]
-            phases = [phase.state for phase in logic.phases]
+            if tl_id not in _PHASE_CACHE:
+                logic = traci.trafficlight.getAllProgramLogics(tl_id)[0]
+                _PHASE_CACHE[tl_id] = [phase.state for phase in logic.phases]
+            traci.trafficlight.subscribe(tl_id, [tc.TL_CURRENT_PROGRAM,
+                                                 tc.TL_RED_YELLOW_GREEN_STATE,
+                                                 tc.TL_CURRENT_PHASE])
+            phases = _PHASE_CACHE[tl_id]
             action_spec[tl_id] = phases
             print(f"  {tl_id}: {len(phases)} phases")
         except Exception as e:
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the sum-tree prioritized replay buffer
+Tests sampling frequencies, priority updates and index bounds
+"""
+
+import unittest
+import sys
+import os
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rl_traffic_controller_enhanced import PrioritizedReplayBuffer
+
+
+def make_buffer(capacity, size, alpha=0.6, state_dim=3):
+    """Buffer with `size` transitions pushed; the state holds the slot index"""
+    buffer = PrioritizedReplayBuffer(capacity=capacity, alpha=alpha, state_dim=state_dim)
+    for i in range(size):
+        state = np.full(state_dim, i, dtype=np.float32)
+        buffer.push(state, i % 4, float(i), state, False)
+    return buffer
+
+
+def leaves(buffer):
+    return buffer._sum_tree[buffer._tree_cap:]
+
+
+class TestSumTree(unittest.TestCase):
+    """Test that the tree stays consistent with its leaves"""
+    
+    def assertTreeConsistent(self, buffer):
+        tree = buffer._sum_tree
+        internal = np.arange(1, buffer._tree_cap)
+        np.testing.assert_allclose(tree[internal], tree[2 * internal] + tree[2 * internal + 1])
+        self.assertAlmostEqual(tree[1], leaves(buffer).sum())
+    
+    def test_push_sets_max_priority(self):
+        """Test that new transitions get the max priority"""
+        buffer = make_buffer(capacity=10, size=7, alpha=0.5)
+        np.testing.assert_allclose(leaves(buffer)[:7], 1.0)
+        np.testing.assert_allclose(leaves(buffer)[7:], 0.0)
+        self.assertTreeConsistent(buffer)
+    
+    def test_update_with_duplicate_indices(self):
+        """Test that repeated indices in one update keep the root equal to the leaf sum"""
+        buffer = make_buffer(capacity=10, size=10)
+        indices = np.array([1, 1, 3, 3, 3, 9, 0, 9])
+        td_errors = np.array([0.5, 2.0, 0.1, 0.2, 4.0, 1.5, 0.05, 3.0])
+        buffer.update_priorities(indices, td_errors)
+    
+        self.assertTreeConsistent(buffer)
+        # The last write for a repeated index wins
+        expected = (np.abs(np.array([2.0, 4.0, 3.0])) + buffer.eps) ** buffer.alpha
+        np.testing.assert_allclose(leaves(buffer)[[1, 3, 9]], expected)
+    
+    def test_update_keeps_max_priority(self):
+        """Test that max_priority tracks the largest TD error seen"""
+        buffer = make_buffer(capacity=8, size=8)
+        buffer.update_priorities(np.array([2]), np.array([5.0]))
+        buffer.update_priorities(np.array([3]), np.array([0.5]))
+        self.assertAlmostEqual(buffer.max_priority, 5.0 + buffer.eps)
+
+
+class TestSampling(unittest.TestCase):
+    """Test prioritized sampling"""
+    
+    def setUp(self):
+        np.random.seed(0)
+    
+    def test_frequencies_follow_priorities(self):
+        """Test that sampling frequencies follow priority**alpha"""
+        alpha = 0.6
+        buffer = make_buffer(capacity=12, size=12, alpha=alpha)
+        td_errors = np.linspace(0.1, 3.0, 12)
+        buffer.update_priorities(np.arange(12), td_errors)
+    
+        counts = np.zeros(12)
+        for _ in range(2000):
+            indices = buffer.sample(64)[5]
+            counts += np.bincount(indices, minlength=12)
+    
+        priorities = (td_errors + buffer.eps) ** alpha
+        np.testing.assert_allclose(counts / counts.sum(), priorities / priorities.sum(), atol=0.005)
+    
+    def test_sampled_transitions_match_indices(self):
+        """Test that the gathered transitions are the ones at the sampled indices"""
+        buffer = make_buffer(capacity=10, size=10)
+        states, actions, rewards, next_states, dones, indices, weights = buffer.sample(32)
+        np.testing.assert_array_equal(states[:, 0], indices)
+        np.testing.assert_array_equal(rewards, indices)
+        self.assertLessEqual(weights.max(), 1.0)
+    
+    def test_indices_stay_below_size(self):
+        """Test that a partly filled buffer never samples unfilled slots"""
+        for capacity, size in [(16, 5), (10, 3), (100, 1), (7, 7)]:
+            buffer = make_buffer(capacity=capacity, size=size)
+            if size > 1:
+                buffer.update_priorities(np.arange(size), np.random.random(size) * 3)
+            for _ in range(500):
+                indices = buffer.sample(32)[5]
+                self.assertTrue((indices >= 0).all())
+                self.assertTrue((indices < size).all(), (capacity, size, indices.max()))
+    
+    def test_indices_clamped_on_float_overshoot(self):
+        """Test that a target rounding past the last filled leaf is clamped"""
+        buffer = make_buffer(capacity=16, size=5)
+        # Root larger than the leaves (exaggerated float drift), so the
+        # highest targets descend past the filled slots into empty leaves
+        buffer._sum_tree[1] *= 1.05
+        for _ in range(200):
+            indices = buffer.sample(16)[5]
+            self.assertTrue((indices < 5).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
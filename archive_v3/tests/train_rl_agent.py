@@ -106,7 +106,7 @@ class DQNTrainer:
                 },
                 'network': {
                     'hidden_layers': [256, 256, 128],
-                    'dropout': 0.2
+                    'dropout': 0.0
                 },
                 'paths': {
                     'model_dir': 'rl_module/models',
@@ -225,6 +225,7 @@ class DQNTrainer:
                       f"Reward: {episode_reward:.2f} | "
                       f"Avg Reward (10): {avg_reward:.2f} | "
                       f"Avg Wait: {avg_wait:.2f}s | "
+                      f"Loss: {agent.flush_metrics():.4f} | "
                       f"Epsilon: {agent.epsilon:.4f} | "
                       f"Steps: {episode_steps} | "
                       f"Time: {episode_time:.1f}s")
@@ -19,12 +19,13 @@ import numpy as np
 from stable_baselines3 import DQN
 from stable_baselines3.common.callbacks import CheckpointCallback, EvalCallback
 from stable_baselines3.common.monitor import Monitor
-from stable_baselines3.common.vec_env import DummyVecEnv
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
 
 from rl_module.vanet_env import VANETTrafficEnv
+from rl_module.helpers import action_spec_from_config
 
 
-def make_env(config_path, rank=0):
+def make_env(config_path, rank=0, action_spec=None):
     """
     Create a VANET environment for training.
     
@@ -34,6 +35,9 @@ def make_env(config_path, rank=0):
         Path to SUMO configuration file
     rank : int
         Environment rank (for multiple parallel environments)
+    action_spec : dict, optional
+        Traffic light id -> phase states, shared by all workers; queried
+        from this environment's SUMO instance when not given
     """
     def _init():
         # Start SUMO for this environment
@@ -46,33 +50,42 @@ def make_env(config_path, rank=0):
             "--step-length", "1",
             "--no-warnings"
         ]
+        if rank > 0:
+            # Keep parallel instances from overwriting each other's output files
+            sumo_cmd += ["--output-prefix", f"sim_{rank}_"]
         
         # Note: port is passed to traci.start(), not in sumo_cmd
         traci.start(sumo_cmd, label=f"sim_{rank}", port=port)
-        traci.switch(f"sim_{rank}")
+        # Hold this simulation's connection instead of relying on traci.switch,
+        # so environments sharing a process never talk to each other's SUMO
+        conn = traci.getConnection(f"sim_{rank}")
         
-        # Get traffic lights
-        tl_ids = traci.trafficlight.getIDList()
-        
-        # Build action spec
-        action_spec = {}
-        for tl_id in tl_ids:
-            try:
-                logic = traci.trafficlight.getAllProgramLogics(tl_id)[0]
-                phases = [phase.state for phase in logic.phases]
-                action_spec[tl_id] = phases
-            except Exception as e:
-                print(f"Warning: Error getting phases for {tl_id}: {e}")
+        spec = action_spec
+        if spec is None:
+            # Get traffic lights
+            tl_ids = conn.trafficlight.getIDList()
+            
+            # Build action spec
+            spec = {}
+            for tl_id in tl_ids:
+                try:
+                    logic = conn.trafficlight.getAllProgramLogics(tl_id)[0]
+                    phases = [phase.state for phase in logic.phases]
+                    spec[tl_id] = phases
+                except Exception as e:
+                    print(f"Warning: Error getting phases for {tl_id}: {e}")
         
         # Create environment
         env_config = {
             'beta': 20,
-            'action_spec': action_spec,
+            'action_spec': spec,
             'tl_constraint_min': 5,
             'tl_constraint_max': 60,
             'sim_step': 1.0,
             'algorithm': 'DQN',
             'horizon': 1000,
+            'use_subscriptions': True,
+            'connection': conn,
         }
         
         env = VANETTrafficEnv(config=env_config)
@@ -97,6 +110,8 @@ def train_dqn(
     target_update_interval=1000,
     save_freq=10000,
     log_interval=100,
+    num_envs=4,
+    vec_env="subproc",
 ):
     """
     Train DQN model for traffic control.
@@ -129,6 +144,14 @@ def train_dqn(
         Save checkpoint every N steps
     log_interval : int
         Log every N steps
+    num_envs : int
+        Number of SUMO environments collecting experience
+    vec_env : str
+        "subproc" runs each environment in its own worker process, which
+        pays off when SUMO stepping and TraCI I/O dominate. "dummy" steps
+        the environments one after another in the training process, each
+        over its own TraCI connection; it avoids the per-step pickling and
+        process sync but the SUMO instances are not stepped concurrently.
     """
     
     print("=" * 80)
@@ -146,8 +169,17 @@ def train_dqn(
     print()
     
     # Create environment
-    print("Creating training environment...")
-    env = DummyVecEnv([make_env(config_path, rank=0)])
+    # Every environment runs its own SUMO instance (distinct port and label);
+    # with subproc workers the rollouts are collected in parallel with the
+    # learner. The action spec is read from the network once here and shipped
+    # to every environment.
+    print(f"Creating {num_envs} training environment(s) ({vec_env})...")
+    action_spec = action_spec_from_config(config_path)
+    env_fns = [make_env(config_path, rank=i, action_spec=action_spec) for i in range(num_envs)]
+    if vec_env == "subproc":
+        env = SubprocVecEnv(env_fns, start_method="spawn")
+    else:
+        env = DummyVecEnv(env_fns)
     
     print("✓ Environment created")
     print(f"  Observation space: {env.observation_space}")
@@ -316,6 +348,18 @@ def main():
         default=10000,
         help='Save checkpoint frequency'
     )
+    parser.add_argument(
+        '--num-envs',
+        type=int,
+        default=4,
+        help='Number of parallel SUMO environments'
+    )
+    parser.add_argument(
+        '--vec-env',
+        choices=['subproc', 'dummy'],
+        default='subproc',
+        help='Run environments in worker processes (subproc) or in-process, one after another (dummy)'
+    )
     
     args = parser.parse_args()
     
@@ -334,7 +378,9 @@ def main():
         batch_size=args.batch_size,
         gamma=args.gamma,
         exploration_fraction=args.exploration,
-        save_freq=args.save_freq
+        save_freq=args.save_freq,
+        num_envs=args.num_envs,
+        vec_env=args.vec_env
     )
     
     if model_path:
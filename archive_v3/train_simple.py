@@ -5,17 +5,28 @@ Trains DQN agent for traffic control
 
 import sys
 import os
+import io
+import contextlib
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
 import numpy as np
-from collections import deque
 import random
 
+# Run SUMO in-process through libsumo (TraCI API, no socket round-trips).
+# traci reads this on first import, so it has to be set before rl_module is
+# loaded; falls back to the socket client if libsumo is not installed.
+if '--traci' not in sys.argv:
+    os.environ.setdefault('LIBSUMO_AS_TRACI', 'quiet')
+
 # Add parent directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 from rl_module.vanet_env import VANETTrafficEnv
+from rl_module.helpers import action_spec_from_config
 
 
 class DQNNetwork(nn.Module):
@@ -35,10 +46,96 @@ class DQNNetwork(nn.Module):
         return self.network(x)
 
 
+class ReplayBuffer:
+    """
+    Experience replay buffer stored as preallocated ring-buffer arrays
+    
+    Fields use the narrowest dtype that holds them (float32 states, int32
+    actions, uint8 dones); train_step widens them when building tensors.
+    Actions are stored as a (capacity, 1) column, the index shape gather expects.
+    
+    With a `device`, the fields are instead torch tensors living on that
+    device, already in the dtypes train_step uses, so each transition is
+    copied to the device once when stored and sampling stays on the device.
+    Their states and next states are stored as `state_dtype` (e.g. bfloat16
+    when training under autocast, halving their memory and bandwidth).
+    """
+    
+    def __init__(self, capacity, state_dim, device=None, state_dtype=torch.float32):
+        self.capacity = capacity
+        self.device = device
+        self._pos = 0
+        self._size = 0
+        
+        if device is None:
+            self.states = np.zeros((capacity, state_dim), dtype=np.float32)
+            self.next_states = np.zeros((capacity, state_dim), dtype=np.float32)
+            self.actions = np.zeros((capacity, 1), dtype=np.int32)
+            self.rewards = np.zeros(capacity, dtype=np.float32)
+            self.dones = np.zeros(capacity, dtype=np.uint8)
+        else:
+            self.states = torch.zeros((capacity, state_dim), dtype=state_dtype, device=device)
+            self.next_states = torch.zeros((capacity, state_dim), dtype=state_dtype, device=device)
+            self.actions = torch.zeros((capacity, 1), dtype=torch.int64, device=device)
+            self.rewards = torch.zeros(capacity, dtype=torch.float32, device=device)
+            self.dones = torch.zeros(capacity, dtype=torch.float32, device=device)
+    
+    def push(self, state, action, reward, next_state, done):
+        if self.device is not None:
+            state = torch.as_tensor(state, dtype=torch.float32)
+            next_state = torch.as_tensor(next_state, dtype=torch.float32)
+        
+        self.states[self._pos] = state
+        self.actions[self._pos] = action
+        self.rewards[self._pos] = reward
+        self.next_states[self._pos] = next_state
+        self.dones[self._pos] = done
+        
+        self._pos = (self._pos + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+    
+    def sample(self, batch_size, out=None):
+        """
+        Sample a batch of (states, actions, rewards, next_states, dones)
+        
+        With `out`, a tuple of arrays shaped like the batch, each field is
+        gathered straight into its array (without an intermediate copy when
+        the dtypes match) and `out` is returned. A device buffer samples on
+        its device; its `out` must be tensors there with the field dtypes.
+        """
+        fields = (self.states, self.actions, self.rewards, self.next_states, self.dones)
+        # torch.randint draws the indices for both storages (on CPU it is
+        # also cheaper than np.random.randint for a batch this size)
+        indices = torch.randint(0, self._size, (batch_size,), device=self.device)
+        if self.device is not None:
+            if out is None:
+                return tuple(field[indices] for field in fields)
+            for field, target in zip(fields, out):
+                torch.index_select(field, 0, indices, out=target)
+            return out
+        
+        indices = indices.numpy()
+        if out is None:
+            return tuple(field[indices] for field in fields)
+        for field, target in zip(fields, out):
+            if field.dtype == target.dtype:
+                # Indices are always in range, so 'clip' only skips the bounds-check buffering
+                np.take(field, indices, axis=0, out=target, mode='clip')
+            else:
+                target[...] = field[indices]
+        return out
+    
+    def __len__(self):
+        return self._size
+
+
 class SimpleDQNAgent:
     """Simple DQN agent for training"""
     
     def __init__(self, state_dim, action_dim, learning_rate=0.001):
+        # Plain ints: gym spaces report numpy integers, which TorchScript
+        # rejects as Linear layer constants
+        state_dim, action_dim = int(state_dim), int(action_dim)
         self.state_dim = state_dim
         self.action_dim = action_dim
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -48,98 +145,253 @@ class SimpleDQNAgent:
         self.target_net = DQNNetwork(state_dim, action_dim).to(self.device)
         self.target_net.load_state_dict(self.policy_net.state_dict())
         
-        # Optimizer
-        self.optimizer = optim.Adam(self.policy_net.parameters(), lr=learning_rate)
+        # bfloat16 autocast for train_step on GPUs that support it. The target
+        # network only ever runs inference, so it is kept in bfloat16 outright;
+        # the policy weights and optimizer state stay float32.
+        self._amp_dtype = None
+        if self.device.type == 'cuda' and torch.cuda.is_bf16_supported():
+            self._amp_dtype = torch.bfloat16
+            self.target_net.to(dtype=torch.bfloat16)
         
-        # Replay buffer
-        self.memory = deque(maxlen=10000)
+        # Compiled Q computations for train_step on GPU (fixed batch shape, so
+        # the captured CUDA graphs stay valid). Each network pass is captured
+        # together with its gather or max + Bellman arithmetic. The plain
+        # modules still own the parameters, so checkpoints are unchanged.
+        if self.device.type == 'cuda':
+            self._current_q = torch.compile(self._current_q, mode='reduce-overhead', fullgraph=True)
+            self._target_q = torch.compile(self._target_q, mode='reduce-overhead', fullgraph=True)
+        
+        # Optimizer (on GPU the fused implementation updates all parameters in one kernel)
+        self.optimizer = optim.Adam(self.policy_net.parameters(), lr=learning_rate,
+                                    fused=self.device.type == 'cuda')
+        
+        # Replay buffer (kept on the GPU when training there, so sampling
+        # needs no host-to-device copies). Under autocast the first Linear
+        # layer rounds its input to the autocast dtype anyway, so states are
+        # stored in that dtype; rewards and dones stay float32.
+        state_dtype = self._amp_dtype or torch.float32
+        self.memory = ReplayBuffer(10000, state_dim,
+                                   device=self.device if self.device.type == 'cuda' else None,
+                                   state_dtype=state_dtype)
         self.batch_size = 64
         
+        # Tensor dtypes of (states, actions, rewards, next_states, dones) in train_step
+        self._batch_dtypes = (state_dtype, torch.int64, torch.float32, state_dtype, torch.float32)
+        
+        # Persistent batch tensors on the device, refilled in place every
+        # train_step: directly on GPU, through numpy views on CPU
+        shapes = ((self.batch_size, state_dim), (self.batch_size, 1), (self.batch_size,),
+                  (self.batch_size, state_dim), (self.batch_size,))
+        self._device_batch = tuple(
+            torch.empty(shape, dtype=dtype, device=self.device)
+            for shape, dtype in zip(shapes, self._batch_dtypes)
+        )
+        if self.memory.device is not None:
+            self._batch_out = self._device_batch
+        else:
+            self._batch_out = tuple(target.numpy() for target in self._device_batch)
+        
+        # TorchScript view of the policy network for select_action: it shares
+        # the policy parameters, and skips most of eager mode's per-op Python
+        # dispatch, which dominates a single-state forward pass. TorchScript is
+        # deprecated in favour of torch.compile, but on CPU compiling costs
+        # tens of seconds and gains nothing at this size.
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            self._act_net = torch.jit.script(self.policy_net)
+        
+        # Persistent single-sample input for select_action, filled through a
+        # numpy view of a host buffer (pinned staging when the input is on GPU)
+        self._act_in = torch.empty((1, state_dim), dtype=torch.float32, device=self.device)
+        self._act_host = self._act_in
+        if self.device.type == 'cuda':
+            self._act_host = torch.empty((1, state_dim), dtype=torch.float32, pin_memory=True)
+        self._act_host_np = self._act_host.numpy()
+        
+        # Allow TF32 matmuls for the Linear layers on Ampere and newer GPUs
+        torch.set_float32_matmul_precision('high')
+        
+        # Single background writer for checkpoints (keeps writes in order)
+        self._save_executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_saves = []
+        
         # Hyperparameters
         self.gamma = 0.99
         self.epsilon = 1.0
         self.epsilon_min = 0.01
         self.epsilon_decay = 0.995
+        self.tau = 0.005  # Polyak rate of the per-step target network update
+        
+        # Parameter lists for the fused in-place target update. A bfloat16
+        # target cannot absorb tau-sized increments, so under autocast the
+        # running average is kept in float32 and copied into the target.
+        self._policy_params = list(self.policy_net.parameters())
+        self._target_params = list(self.target_net.parameters())
+        self._target_master = self._target_params
+        if self._amp_dtype is not None:
+            self._target_master = [p.detach().float().clone() for p in self._target_params]
         
+    def _current_q(self, states, actions):
+        """Q values of the taken actions under the policy network"""
+        return self.policy_net(states).gather(1, actions).squeeze(1)
+    
+    def _target_q(self, rewards, next_states, dones):
+        """One-step TD targets from the target network"""
+        next_q = self.target_net(next_states).max(1)[0]
+        # rewards + gamma * (1 - dones) * next_q as one select and one fused multiply-add
+        discount = torch.where(dones.bool(), 0.0, self.gamma)
+        return torch.addcmul(rewards, discount, next_q)
+    
     def select_action(self, state, training=True):
         """Select action using epsilon-greedy policy"""
         if training and random.random() < self.epsilon:
             return random.randrange(self.action_dim)
         
-        with torch.no_grad():
-            state_tensor = torch.FloatTensor(state).unsqueeze(0).to(self.device)
-            q_values = self.policy_net(state_tensor)
-            return q_values.argmax().item()
+        return self._greedy_action(state)
+    
+    def select_actions(self, states, training=True):
+        """
+        Select actions for a batch of states (e.g. one per parallel environment)
+        
+        Exploration is drawn first, and a single forward pass then covers
+        every state; it is skipped entirely when all of them explore.
+        """
+        states = np.asarray(states, dtype=np.float32)
+        n = len(states)
+        explore = np.random.random(n) < self.epsilon if training else np.zeros(n, dtype=bool)
+        random_actions = np.random.randint(0, self.action_dim, n)
+        if explore.all():
+            return random_actions
+        
+        with torch.inference_mode():
+            q_values = self._act_net(torch.from_numpy(states).to(self.device))
+            greedy = torch.argmax(q_values, dim=1).cpu().numpy()
+        return np.where(explore, random_actions, greedy)
+    
+    def _greedy_action(self, state):
+        """Best action for a single state under the policy network"""
+        # The previous call's argmax read synchronised, so the staging buffer is free
+        self._act_host_np[0] = state
+        with torch.inference_mode():
+            if self._act_host is not self._act_in:
+                self._act_in.copy_(self._act_host, non_blocking=True)
+            q_values = self._act_net(self._act_in)
+            return int(torch.argmax(q_values, dim=1))
     
     def store_transition(self, state, action, reward, next_state, done):
         """Store transition in replay buffer"""
-        self.memory.append((state, action, reward, next_state, done))
+        self.memory.push(state, action, reward, next_state, done)
     
     def train_step(self):
-        """Perform one training step"""
-        if len(self.memory) < self.batch_size:
-            return 0.0
-        
-        # Sample batch
-        batch = random.sample(self.memory, self.batch_size)
-        states, actions, rewards, next_states, dones = zip(*batch)
+        """
+        Perform one training step
         
-        # Convert to tensors
-        states = torch.FloatTensor(states).to(self.device)
-        actions = torch.LongTensor(actions).to(self.device)
-        rewards = torch.FloatTensor(rewards).to(self.device)
-        next_states = torch.FloatTensor(next_states).to(self.device)
-        dones = torch.FloatTensor(dones).to(self.device)
-        
-        # Compute Q values
-        current_q = self.policy_net(states).gather(1, actions.unsqueeze(1))
+        Returns the loss as a detached 0-dim tensor on the training device,
+        or None while the replay buffer holds less than one batch. The loss
+        is not copied to the host here, so on GPU the step runs
+        asynchronously; convert it with float() only when it is needed.
+        """
+        if len(self.memory) < self.batch_size:
+            return None
         
-        # Compute target Q values
-        with torch.no_grad():
-            next_q = self.target_net(next_states).max(1)[0]
-            target_q = rewards + (1 - dones) * self.gamma * next_q
+        # Sample straight into the persistent batch tensors (actions and dones widened)
+        self.memory.sample(self.batch_size, out=self._batch_out)
+        states, actions, rewards, next_states, dones = self._device_batch
         
-        # Compute loss
-        loss = nn.MSELoss()(current_q.squeeze(), target_q)
+        amp = (torch.autocast(device_type=self.device.type, dtype=self._amp_dtype)
+               if self._amp_dtype is not None else contextlib.nullcontext())
+        with amp:
+            # Compute Q values
+            current_q = self._current_q(states, actions)
+            
+            # Compute target Q values
+            # no_grad rather than inference_mode: mse_loss saves target_q for
+            # backward, which autograd refuses for inference tensors
+            with torch.no_grad():
+                target_q = self._target_q(rewards, next_states, dones)
+            
+            # Compute loss
+            loss = F.mse_loss(current_q, target_q)
         
         # Optimize
         self.optimizer.zero_grad()
         loss.backward()
         self.optimizer.step()
+        self.soft_update_target_network()
         
-        return loss.item()
+        return loss.detach()
+    
+    def soft_update_target_network(self):
+        """Polyak-average the policy weights into the target network, in place"""
+        with torch.inference_mode():
+            torch._foreach_lerp_(self._target_master, self._policy_params, self.tau)
+            if self._target_master is not self._target_params:
+                torch._foreach_copy_(self._target_params, self._target_master)
     
     def update_target_network(self):
-        """Update target network"""
+        """Update target network (hard copy of the policy weights)"""
         self.target_net.load_state_dict(self.policy_net.state_dict())
+        if self._target_master is not self._target_params:
+            with torch.no_grad():
+                torch._foreach_copy_(self._target_master, self._policy_params)
     
     def decay_epsilon(self):
         """Decay exploration rate"""
         self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
     
     def save(self, path):
-        """Save model"""
-        os.makedirs(os.path.dirname(path), exist_ok=True)
+        """
+        Save model
+        
+        The checkpoint is serialized in memory right away, then written to
+        `path` with a single write by a background thread, so training does
+        not wait on the filesystem. Use `wait_for_saves` before relying on
+        the file.
+        """
+        buffer = io.BytesIO()
         torch.save({
             'policy_net': self.policy_net.state_dict(),
             'target_net': self.target_net.state_dict(),
             'optimizer': self.optimizer.state_dict(),
             'epsilon': self.epsilon
-        }, path)
+        }, buffer, _use_new_zipfile_serialization=True)
+        self._pending_saves.append(self._save_executor.submit(self._write_checkpoint, path, buffer))
+    
+    @staticmethod
+    def _write_checkpoint(path, buffer):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(buffer.getbuffer())
         print(f"Model saved to {path}")
     
+    def wait_for_saves(self):
+        """Block until every queued checkpoint is on disk (re-raises write errors)"""
+        pending, self._pending_saves = self._pending_saves, []
+        for future in pending:
+            future.result()
+    
     def load(self, path):
         """Load model"""
-        checkpoint = torch.load(path, map_location=self.device)
+        self.wait_for_saves()
+        # Tensors only (no arbitrary unpickling), storages memory-mapped from disk
+        checkpoint = torch.load(path, map_location=self.device, mmap=True, weights_only=True)
         self.policy_net.load_state_dict(checkpoint['policy_net'])
         self.target_net.load_state_dict(checkpoint['target_net'])
+        if self._target_master is not self._target_params:
+            with torch.no_grad():
+                torch._foreach_copy_(self._target_master, self._target_params)
         self.optimizer.load_state_dict(checkpoint['optimizer'])
         self.epsilon = checkpoint['epsilon']
         print(f"Model loaded from {path}")
 
 
-def train_dqn(episodes=100, max_steps=1000):
-    """Train DQN agent"""
+def train_dqn(episodes=100, max_steps=1000, gradient_steps=1):
+    """
+    Train DQN agent
+    
+    Runs `gradient_steps` training steps (each on a fresh batch) after every
+    environment step.
+    """
     
     print("=" * 60)
     print("Simple DQN Training for Traffic Control")
@@ -155,20 +407,13 @@ def train_dqn(episodes=100, max_steps=1000):
     
     print("Starting SUMO...")
     sumo_binary = sumolib.checkBinary('sumo')  # Use sumo (no GUI) for training
-    sumo_cmd = [sumo_binary, "-c", config_path, "--start", "--quit-on-end"]
+    sumo_cmd = [sumo_binary, "-c", config_path, "--start"]
     
     traci.start(sumo_cmd)
     
-    # Get traffic light IDs
-    tl_ids = traci.trafficlight.getIDList()
-    print(f"Found traffic lights: {tl_ids}")
-    
-    # Create action spec
-    action_spec = {}
-    for tl_id in tl_ids:
-        logic = traci.trafficlight.getAllProgramLogics(tl_id)[0]
-        phases = [phase.state for phase in logic.phases]
-        action_spec[tl_id] = phases
+    # Create action spec straight from the network file (no TraCI queries)
+    action_spec = action_spec_from_config(config_path)
+    print(f"Found traffic lights: {list(action_spec)}")
     
     print(f"Action spec: {len(action_spec)} intersections")
     
@@ -181,6 +426,7 @@ def train_dqn(episodes=100, max_steps=1000):
         'sim_step': 1.0,
         'algorithm': 'DQN',
         'horizon': max_steps,
+        'use_subscriptions': True,
     }
     
     # Create environment
@@ -200,12 +446,15 @@ def train_dqn(episodes=100, max_steps=1000):
     
     # Training loop
     best_reward = -float('inf')
-    episode_rewards = []
+    # Last 10 episode rewards as a ring buffer with a running sum
+    reward_ring = np.zeros(10)
+    reward_ring_sum = 0.0
     
     for episode in range(episodes):
-        # Restart SUMO for each episode
-        traci.close()
-        traci.start(sumo_cmd)
+        # Reload the scenario in the running SUMO instead of restarting it
+        # (the first episode uses the one traci.start just loaded)
+        if episode > 0:
+            traci.load(sumo_cmd[1:])
         
         reset_result = env.reset()
         if len(reset_result) == 2:
@@ -214,12 +463,22 @@ def train_dqn(episodes=100, max_steps=1000):
         else:
             # Old gym API or single return
             state = reset_result
-        episode_reward = 0
-        losses = []
+        episode_reward = 0.0
+        # Losses stay on the device and are summed there; read back once per episode
+        loss_sum = 0.0
+        loss_count = 0
+        
+        # Epsilon only changes between episodes, so the whole episode's
+        # exploration draws and random actions are sampled up front
+        pre_explore = np.random.random(max_steps) < agent.epsilon
+        pre_actions = np.random.randint(0, agent.action_dim, size=max_steps, dtype=np.int32)
         
         for step in range(max_steps):
-            # Select action
-            action = agent.select_action(state, training=True)
+            # Select action (epsilon-greedy)
+            if pre_explore[step]:
+                action = int(pre_actions[step])
+            else:
+                action = agent._greedy_action(state)
             
             # Take step
             step_result = env.step(action)
@@ -235,9 +494,11 @@ def train_dqn(episodes=100, max_steps=1000):
             agent.store_transition(state, action, reward, next_state, done)
             
             # Train
-            loss = agent.train_step()
-            if loss > 0:
-                losses.append(loss)
+            for _ in range(gradient_steps):
+                loss = agent.train_step()
+                if loss is not None:
+                    loss_sum += loss
+                    loss_count += 1
             
             episode_reward += reward
             state = next_state
@@ -245,24 +506,20 @@ def train_dqn(episodes=100, max_steps=1000):
             if done:
                 break
         
-        # Update target network every 10 episodes
-        if episode % 10 == 0:
-            agent.update_target_network()
-        
         # Decay epsilon
         agent.decay_epsilon()
         
         # Track rewards
-        episode_rewards.append(episode_reward)
-        avg_loss = np.mean(losses) if losses else 0
+        slot = episode % len(reward_ring)
+        reward_ring_sum += episode_reward - reward_ring[slot]
+        reward_ring[slot] = episode_reward
         
         # Print progress
         if episode % 5 == 0:
-            avg_reward = np.mean(episode_rewards[-10:])
-            print(f"Episode {episode}/{episodes}")
-            print(f"  Reward: {episode_reward:.2f} | Avg(10): {avg_reward:.2f}")
-            print(f"  Loss: {avg_loss:.4f} | Epsilon: {agent.epsilon:.3f}")
-            print()
+            avg_reward = reward_ring_sum / min(episode + 1, len(reward_ring))
+            avg_loss = float(loss_sum) / max(loss_count, 1)
+            print(f"Episode {episode}/{episodes} | Reward: {episode_reward:.2f} | Avg(10): {avg_reward:.2f} | "
+                  f"Loss: {avg_loss:.4f} | Epsilon: {agent.epsilon:.3f}")
         
         # Save best model
         if episode_reward > best_reward:
@@ -271,6 +528,7 @@ def train_dqn(episodes=100, max_steps=1000):
     
     # Save final model
     agent.save('models/dqn_traffic_final.pth')
+    agent.wait_for_saves()
     
     print("=" * 60)
     print("Training completed!")
@@ -288,7 +546,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Train DQN agent for traffic control')
     parser.add_argument('--episodes', type=int, default=100, help='Number of episodes')
     parser.add_argument('--steps', type=int, default=1000, help='Max steps per episode')
+    parser.add_argument('--gradient-steps', type=int, default=1, help='Training steps per environment step')
+    parser.add_argument('--traci', action='store_true', help='Use the TraCI socket client instead of libsumo')
     
     args = parser.parse_args()
     
-    train_dqn(episodes=args.episodes, max_steps=args.steps)
+    train_dqn(episodes=args.episodes, max_steps=args.steps, gradient_steps=args.gradient_steps)
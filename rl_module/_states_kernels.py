@@ -0,0 +1,61 @@
+"""
+Compiled kernels for state encoding.
+Numba is optional; without it callers keep their pure NumPy paths.
+"""
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Fallback no-op decorator when numba is not installed"""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+_RED = ord('r')
+_YELLOW = ord('y')
+
+
+@njit(cache=True)
+def encode_tl_bits(buf, out):
+    """Writes 0 for red/yellow and 1 for any other light character.
+
+    Parameters
+    ----------
+    buf: np.ndarray of uint8
+        Concatenated ASCII traffic light states.
+    out: np.ndarray of uint8
+        Output with the same length as `buf`.
+    """
+    for i in range(buf.size):
+        c = buf[i]
+        out[i] = 0 if (c == _RED or c == _YELLOW) else 1
+
+
+@njit(cache=True)
+def pack_vehicle_state(rows, vals, n, out):
+    """Scatters per-vehicle values into the [speeds | orientations | CO2] layout.
+
+    Parameters
+    ----------
+    rows: np.ndarray of int64
+        Row of each vehicle in the encoding.
+    vals: np.ndarray of float32, shape (len(rows), 5)
+        Speed, x, y, angle and CO2 emission per vehicle.
+    n: int
+        Number of rows in the encoding.
+    out: np.ndarray of float32
+        Output of length ``5 * n``; rows without a vehicle are zeroed.
+    """
+    out[:] = 0.0
+    for i in range(rows.size):
+        r = rows[i]
+        out[r] = vals[i, 0]
+        out[n + 3 * r] = vals[i, 1]
+        out[n + 3 * r + 1] = vals[i, 2]
+        out[n + 3 * r + 2] = vals[i, 3]
+        out[4 * n + r] = vals[i, 4]
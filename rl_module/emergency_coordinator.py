@@ -3,11 +3,11 @@ Emergency Vehicle Coordinator for Greenwave System
 Integrates with RSUs to detect ambulances and coordinate greenwave across junctions
 """
 
+import math
 import traci
 from typing import Dict, List, Tuple, Optional, Set
 from dataclasses import dataclass
 from collections import defaultdict
-import numpy as np
 from rsu_config import get_junction_rsus, get_rsu_positions
 
 
@@ -47,7 +47,7 @@ class EmergencyVehicleCoordinator:
     4. Relay information between RSUs
     """
     
-    def __init__(self, rsu_range: float = 300.0):
+    def __init__(self, rsu_range: float = 300.0, conn=None):
         """
         Initialize the emergency coordinator.
         
@@ -55,8 +55,12 @@ class EmergencyVehicleCoordinator:
         ----------
         rsu_range : float
             Detection range of RSUs in meters
+        conn : traci.connection.Connection, optional
+            TraCI connection of the simulation to coordinate; defaults to
+            the module-level traci, i.e. the active connection
         """
         self.rsu_range = rsu_range
+        self.conn = conn if conn is not None else traci
         
         # Track emergency vehicles
         self.emergency_vehicles: Dict[str, EmergencyVehicle] = {}
@@ -68,6 +72,9 @@ class EmergencyVehicleCoordinator:
         
         # Historical data
         self.emergency_detections: List[Tuple[float, str, str]] = []  # (time, veh_id, rsu_id)
+        
+        # Vehicle types never change during a run, so query each one once
+        self._veh_types: Dict[str, str] = {}
     
     def reset(self):
         """
@@ -78,16 +85,17 @@ class EmergencyVehicleCoordinator:
         self.emergency_vehicles.clear()
         self.active_greenwaves.clear()
         self.emergency_detections.clear()
+        self._veh_types.clear()
         
     def initialize_network_topology(self):
         """Initialize network topology from SUMO."""
         try:
             # Get all junctions
-            junction_ids = traci.junction.getIDList()
+            junction_ids = self.conn.junction.getIDList()
             
             for junc_id in junction_ids:
                 # Get junction position
-                x, y = traci.junction.getPosition(junc_id)
+                x, y = self.conn.junction.getPosition(junc_id)
                 
                 # Get incoming and outgoing edges
                 # Use edge API instead of junction API for compatibility
@@ -96,7 +104,7 @@ class EmergencyVehicleCoordinator:
                 
                 # Get all edges and check which ones connect to this junction
                 try:
-                    all_edges = traci.edge.getIDList()
+                    all_edges = self.conn.edge.getIDList()
                     for edge_id in all_edges:
                         # Skip internal edges (they start with ':')
                         if edge_id.startswith(':'):
@@ -104,8 +112,8 @@ class EmergencyVehicleCoordinator:
                         
                         try:
                             # Get edge's to and from junctions
-                            from_junc = traci.edge.getFromJunction(edge_id) if hasattr(traci.edge, 'getFromJunction') else None
-                            to_junc = traci.edge.getToJunction(edge_id) if hasattr(traci.edge, 'getToJunction') else None
+                            from_junc = self.conn.edge.getFromJunction(edge_id) if hasattr(self.conn.edge, 'getFromJunction') else None
+                            to_junc = self.conn.edge.getToJunction(edge_id) if hasattr(self.conn.edge, 'getToJunction') else None
                             
                             if to_junc == junc_id:
                                 incoming.append(edge_id)
@@ -119,10 +127,10 @@ class EmergencyVehicleCoordinator:
                 
                 # Try to find associated traffic light
                 tl_id = None
-                tl_ids = traci.trafficlight.getIDList()
+                tl_ids = self.conn.trafficlight.getIDList()
                 for tl in tl_ids:
                     try:
-                        tl_junctions = traci.trafficlight.getControlledJunctions(tl) if hasattr(traci.trafficlight, 'getControlledJunctions') else []
+                        tl_junctions = self.conn.trafficlight.getControlledJunctions(tl) if hasattr(self.conn.trafficlight, 'getControlledJunctions') else []
                         if junc_id in tl_junctions or tl == junc_id:
                             tl_id = tl
                             break
@@ -173,7 +181,7 @@ class EmergencyVehicleCoordinator:
         detected = []
         
         try:
-            all_vehicles = traci.vehicle.getIDList()
+            all_vehicles = self.conn.vehicle.getIDList()
             
             for veh_id in all_vehicles:
                 # Check if vehicle is an emergency vehicle
@@ -186,12 +194,12 @@ class EmergencyVehicleCoordinator:
                     if veh_id not in all_vehicles:
                         continue
                     
-                    edge_id = traci.vehicle.getRoadID(veh_id)
-                    lane_id = traci.vehicle.getLaneID(veh_id)
-                    position = traci.vehicle.getLanePosition(veh_id)
-                    speed = traci.vehicle.getSpeed(veh_id)
-                    route = traci.vehicle.getRoute(veh_id)
-                    veh_pos = traci.vehicle.getPosition(veh_id)
+                    edge_id = self.conn.vehicle.getRoadID(veh_id)
+                    lane_id = self.conn.vehicle.getLaneID(veh_id)
+                    position = self.conn.vehicle.getLanePosition(veh_id)
+                    speed = self.conn.vehicle.getSpeed(veh_id)
+                    route = self.conn.vehicle.getRoute(veh_id)
+                    veh_pos = self.conn.vehicle.getPosition(veh_id)
                     
                     # Check if vehicle is within range of any RSU
                     detecting_rsu = self._find_nearest_rsu(veh_pos)
@@ -201,6 +209,9 @@ class EmergencyVehicleCoordinator:
                         if veh_id not in self.emergency_vehicles:
                             print(f"🚨 Emergency vehicle detected: {veh_id} by {detecting_rsu}")
                             self.emergency_detections.append((current_time, veh_id, detecting_rsu))
+                            # Position subscription: consumers read it in one batch per step,
+                            # and SUMO drops it when the vehicle leaves
+                            self.conn.vehicle.subscribe(veh_id, [traci.constants.VAR_POSITION])
                         
                         emergency_veh = EmergencyVehicle(
                             vehicle_id=veh_id,
@@ -236,12 +247,15 @@ class EmergencyVehicleCoordinator:
             return True
         
         # Check by vehicle type
-        try:
-            veh_type = traci.vehicle.getTypeID(veh_id)
-            if veh_type == 'emergency':
-                return True
-        except:
-            pass
+        veh_type = self._veh_types.get(veh_id)
+        if veh_type is None:
+            try:
+                veh_type = self.conn.vehicle.getTypeID(veh_id)
+            except:
+                return False
+            self._veh_types[veh_id] = veh_type
+        if veh_type == 'emergency':
+            return True
         
         return False
     
@@ -251,8 +265,7 @@ class EmergencyVehicleCoordinator:
         nearest_rsu = None
         
         for rsu_id, rsu_pos in self.rsu_positions.items():
-            distance = np.sqrt((vehicle_pos[0] - rsu_pos[0])**2 + 
-                             (vehicle_pos[1] - rsu_pos[1])**2)
+            distance = math.hypot(vehicle_pos[0] - rsu_pos[0], vehicle_pos[1] - rsu_pos[1])
             
             if distance <= self.rsu_range and distance < min_distance:
                 min_distance = distance
@@ -292,10 +305,13 @@ class EmergencyVehicleCoordinator:
                         if junc.tl_id and junc.tl_id not in greenwave_junctions:
                             greenwave_junctions.append(junc.tl_id)
             
-            # Update active greenwaves
+            # Update active greenwaves (announced only when the junction list changes,
+            # since this runs every step while the vehicle is tracked)
             if greenwave_junctions:
+                previous = self.active_greenwaves.get(emergency_veh.vehicle_id)
                 self.active_greenwaves[emergency_veh.vehicle_id] = greenwave_junctions
-                print(f"🟢 Greenwave created for {emergency_veh.vehicle_id}: {greenwave_junctions}")
+                if greenwave_junctions != previous:
+                    print(f"🟢 Greenwave created for {emergency_veh.vehicle_id}: {greenwave_junctions}")
             
         except Exception as e:
             print(f"Error creating greenwave: {e}")
@@ -320,8 +336,8 @@ class EmergencyVehicleCoordinator:
         """
         try:
             # Get current traffic light state
-            current_phase = traci.trafficlight.getPhase(tl_id)
-            controlled_links = traci.trafficlight.getControlledLinks(tl_id)
+            current_phase = self.conn.trafficlight.getPhase(tl_id)
+            controlled_links = self.conn.trafficlight.getControlledLinks(tl_id)
             
             # Find which links correspond to the emergency vehicle's edge
             target_link_indices = []
@@ -336,7 +352,7 @@ class EmergencyVehicleCoordinator:
                 return None
             
             # Find a phase that gives green to these links
-            programs = traci.trafficlight.getAllProgramLogics(tl_id)
+            programs = self.conn.trafficlight.getAllProgramLogics(tl_id)
             if not programs:
                 return None
             
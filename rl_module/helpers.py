@@ -1,5 +1,8 @@
 """Utility methods for RL environment."""
 
+import os
+import xml.etree.ElementTree as ET
+
 import numpy as np
 
 
@@ -78,3 +81,36 @@ def pad_list(lst, length, pad_with=0):
 
     lst += [pad_with] * (length - len(lst))
     return lst
+
+
+def action_spec_from_config(config_path):
+    """Builds the environment action spec from a SUMO configuration.
+
+    The phases are read straight from the network file the configuration
+    points to, so no SUMO instance has to run. Lights are ordered by id and
+    each uses its first program by id, as TraCI's ``getIDList`` and
+    ``getAllProgramLogics`` report them.
+
+    Parameters
+    ----------
+    config_path: str
+        Path to the ``.sumocfg`` file.
+
+    Returns
+    -------
+    action_spec: dict
+        Traffic light id -> list of phase state strings.
+    """
+    import sumolib
+
+    net_file = ET.parse(config_path).getroot().find('input/net-file').get('value')
+    net_file = os.path.join(os.path.dirname(os.path.abspath(config_path)), net_file)
+    net = sumolib.net.readNet(net_file, withPrograms=True)
+
+    action_spec = {}
+    for tls in sorted(net.getTrafficLights(), key=lambda tls: tls.getID()):
+        programs = tls.getPrograms()
+        if programs:
+            program = programs[min(programs)]
+            action_spec[tls.getID()] = [phase.state for phase in program.getPhases()]
+    return action_spec
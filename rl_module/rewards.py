@@ -14,24 +14,46 @@ class Rewards:
     All public methods return an integer corresponding to the reward calculated
     at that time step."""
 
-    def __init__(self, action_spec):
+    def __init__(self, action_spec, conn=None, veh=None):
         """Instantiates a Reward object.
 
         Parameters
         ----------
         action_spec: dict
             OrderedDict of controlled traffic light IDs with their allowed
-            states."""
+            states.
+        conn: traci.connection.Connection, optional
+            TraCI connection to read from; defaults to the module-level
+            traci, i.e. the active connection.
+        veh: states.VehicleStates, optional
+            When given, vehicle ids, speeds and emissions are read from its
+            last `update` (one subscription fetch per step) instead of
+            being queried per vehicle. It must be updated with every
+            vehicle on the map before rewards are computed."""
         self.action_spec = action_spec
+        self.conn = conn if conn is not None else traci
+        self.veh = veh
         self.tl_states = []  # traffic light states
 
     def _get_veh_ids(self):
         """Returns IDs of vehicles on the map at current time step."""
+        if self.veh is not None:
+            return self.veh.ids
         try:
-            return traci.vehicle.getIDList()
+            return self.conn.vehicle.getIDList()
         except:
             return []
 
+    def _speed(self, veh_id):
+        if self.veh is not None:
+            return self.veh.speed(veh_id)
+        return self.conn.vehicle.getSpeed(veh_id)
+
+    def _co2_emission(self, veh_id):
+        if self.veh is not None:
+            return self.veh.co2_emission(veh_id)
+        return self.conn.vehicle.getCO2Emission(veh_id)
+
     def _get_obs_veh_ids(self):
         """Returns IDs of the beta observable vehicles on the map at current
         time step."""
@@ -57,7 +79,7 @@ class Rewards:
         try:
             return np.sum([
                 reward
-                if traci.vehicle.getSpeed(veh_id) > min_speed else penalty
+                if self._speed(veh_id) > min_speed else penalty
                 for veh_id in self._get_obs_veh_ids()
             ])
         except:
@@ -73,7 +95,7 @@ class Rewards:
              penalty to assign to vehicles traveling under min_speed"""
         try:
             current_states = [
-                traci.trafficlight.getRedYellowGreenState(tl_id)
+                self.conn.trafficlight.getRedYellowGreenState(tl_id)
                 for tl_id in self._get_controlled_tl_ids()
             ]
 
@@ -107,7 +129,7 @@ class Rewards:
              penalty to assign to vehicles emitting more than max_emission."""
         try:
             return np.sum([
-                reward if traci.vehicle.getCO2Emission(veh_id)
+                reward if self._co2_emission(veh_id)
                 < max_emission else penalty for veh_id in self._get_veh_ids()
             ])
         except:
@@ -167,7 +189,7 @@ class Rewards:
             veh_ids = self._get_veh_ids()
             if not veh_ids:
                 return 0
-            speeds = [traci.vehicle.getSpeed(veh_id) for veh_id in veh_ids]
+            speeds = [self._speed(veh_id) for veh_id in veh_ids]
             return np.mean(speeds)
         except:
             return 0
@@ -179,7 +201,7 @@ class Rewards:
             if not veh_ids:
                 return 0
             emission = [
-                traci.vehicle.getCO2Emission(veh_id)
+                self._co2_emission(veh_id)
                 for veh_id in veh_ids
             ]
             return np.mean(emission)
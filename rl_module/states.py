@@ -4,22 +4,69 @@ Adapted from RL-Traffic-optimization_CIL4sys
 """
 
 import numpy as np
-import traci
-from collections import OrderedDict
 
 # Import with proper path handling
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__)))
 
-from helpers import flatten
+from _states_kernels import NUMBA_AVAILABLE, encode_tl_bits, pack_vehicle_state
+
+# TraCI variable ids (see traci.constants), kept here so importing this
+# module does not import traci
+_TL_RED_YELLOW_GREEN_STATE = 0x20
+_VAR_SPEED = 0x40
+_VAR_POSITION = 0x42
+_VAR_ANGLE = 0x43
+_VAR_CO2EMISSION = 0x60
+_VAR_WAITING_TIME = 0x7a
+
+_traci = None
+
+
+def _t():
+    """Returns the traci module, importing it on first use.
+
+    Importing traci costs ~200 ms, so it is deferred until SUMO is actually
+    driven. The plain ``import traci`` is kept on purpose: it resolves to
+    libsumo when LIBSUMO_AS_TRACI is set, so the encoders always talk to the
+    same backend that started the simulation.
+    """
+    global _traci
+    if _traci is None:
+        import traci
+        _traci = traci
+    return _traci
+
+
+# Byte -> on/off lookup for SUMO light states: red and yellow are off
+_TL_TABLE = bytes(0 if chr(i) in "ry" else 1 for i in range(256))
+
+# Below this many state characters bytes.translate beats the Numba kernel
+NUMBA_MIN_TL_CHARS = 1024
 
 
 class TrafficLightsStates:
     """Handles traffic light state encoding."""
     
-    def __init__(self):
-        pass
+    def __init__(self, conn=None):
+        self.conn = conn
+
+    def _tl_state(self, tl_id):
+        """Returns the subscribed light state of `tl_id` as ASCII bytes.
+
+        The light is (re)subscribed whenever it has no result, e.g. on first
+        use or after the simulation was reloaded. A light that still has no
+        state reads as a single red light.
+        """
+        trafficlight = (self.conn or _t()).trafficlight
+        state = (trafficlight.getSubscriptionResults(tl_id) or {}).get(_TL_RED_YELLOW_GREEN_STATE)
+        if state is None:
+            trafficlight.subscribe(tl_id, [_TL_RED_YELLOW_GREEN_STATE])
+            state = (trafficlight.getSubscriptionResults(tl_id) or {}).get(_TL_RED_YELLOW_GREEN_STATE)
+            if state is None:
+                return b"r"
+        return state.encode('ascii')
 
     def _binary_ohe_tl(self, tl_id):
         """Encodes traffic light state.
@@ -37,15 +84,10 @@ class TrafficLightsStates:
 
         Returns
         ----------
-        encoded_state: [bool]
+        encoded_state: np.ndarray of uint8
             Encoded light state
         """
-        try:
-            state = list(traci.trafficlight.getRedYellowGreenState(tl_id))
-            red_lights = list("ry")
-            return [0 if s in red_lights else 1 for s in state]
-        except:
-            return [0]
+        return np.frombuffer(self._tl_state(tl_id).translate(_TL_TABLE), dtype=np.uint8)
 
     def binary_state_ohe(self, ids):
         """Encodes traffic light states into a binary vector representation.
@@ -57,9 +99,14 @@ class TrafficLightsStates:
 
         Returns
         -------
-        encoded_state: List<0|1>
+        encoded_state: np.ndarray of uint8
              Encoded traffic light states in same order as `ids`."""
-        return np.concatenate([self._binary_ohe_tl(tl_id) for tl_id in ids])
+        states = b"".join([self._tl_state(tl_id) for tl_id in ids])
+        if NUMBA_AVAILABLE and len(states) >= NUMBA_MIN_TL_CHARS:
+            encoded = np.empty(len(states), dtype=np.uint8)
+            encode_tl_bits(np.frombuffer(states, dtype=np.uint8), encoded)
+            return encoded
+        return np.frombuffer(states.translate(_TL_TABLE), dtype=np.uint8)
 
     def wait_steps(self, tl_wait_steps):
         """Returns how many steps each intersection have maintained state for.
@@ -81,15 +128,71 @@ class TrafficLightsStates:
 
 
 class VehicleStates:
-    """Handles vehicle state encoding."""
+    """Handles vehicle state encoding.
+
+    Every encoding starts with `beta` placeholder rows keyed
+    ``vehicle_<i>``; ids that are not placeholders get the rows after
+    them, in order of first appearance. The encoders fill reusable
+    float32 buffers, so each returned array is only valid until the
+    next call of the same encoder.
+    """
     
-    def __init__(self, beta):
+    # Variables read for every updated vehicle, fetched in one batch per step
+    SUBSCRIPTION_VARS = [_VAR_SPEED, _VAR_POSITION, _VAR_ANGLE, _VAR_CO2EMISSION, _VAR_WAITING_TIME]
+    
+    def __init__(self, beta, conn=None):
         self.beta = beta
+        self.conn = conn
+        self.ids = []
+        self._results = {}
+
+        self._veh_keys = ['vehicle_' + str(i) for i in range(beta)]
+        self._key_to_row = {k: i for i, k in enumerate(self._veh_keys)}
+        self._speed_buf = np.zeros(2 * beta, dtype=np.float32)
+        self._orient_buf = np.zeros((2 * beta, 3), dtype=np.float32)
+        self._co2_buf = np.zeros(2 * beta, dtype=np.float32)
+        self._wait_buf = np.zeros(2 * beta, dtype=np.float32)
+        self._pack_buf = np.zeros(10 * beta, dtype=np.float32)
+
+    def update(self, ids):
+        """Subscribes newly seen vehicles and caches this step's results.
 
-    def _get_odict(self, placeholder):
-        return OrderedDict(
-            [('vehicle_' + str(i), placeholder)
-             for i in range(self.beta)])
+        Must be called once per step, before `speeds`, `orientations` and
+        `CO2_emissions`, which then read from the cache instead of querying
+        TraCI per vehicle.
+
+        Parameters
+        ----------
+        ids: List<String>
+            List of vehicle ids observed this step, kept as `ids`.
+        """
+        self.ids = ids
+        vehicle = (self.conn or _t()).vehicle
+        results = vehicle.getAllSubscriptionResults()
+        # New vehicles, and any after a reload (which drops all subscriptions)
+        missing = [veh_id for veh_id in ids if _VAR_SPEED not in results.get(veh_id, ())]
+        for veh_id in missing:
+            vehicle.subscribe(veh_id, self.SUBSCRIPTION_VARS)
+        if missing:
+            results = vehicle.getAllSubscriptionResults()
+        self._results = results
+
+    def _rows(self, ids):
+        """Returns the row of each id and the number of rows in use."""
+        rows = []
+        extra = {}
+        for veh_id in ids:
+            row = self._key_to_row.get(veh_id)
+            if row is None:
+                row = extra.setdefault(veh_id, self.beta + len(extra))
+            rows.append(row)
+        return rows, self.beta + len(extra)
+
+    def _fit(self, buf, n):
+        """Returns `buf`, regrown if it holds fewer than `n` rows."""
+        if len(buf) < n:
+            buf = np.zeros((2 * n,) + buf.shape[1:], dtype=buf.dtype)
+        return buf
 
     def _odict_to_list(self, odict):
         return list(odict.values())
@@ -108,6 +211,33 @@ class VehicleStates:
              Encoded orientations in same order as `ids`."""
         return self._odict_to_list(veh_accs)
 
+    def speed(self, veh_id):
+        """Returns the cached speed of `veh_id` from the last `update`.
+
+        Raises
+        ------
+        KeyError
+            If `veh_id` was not part of the last update."""
+        return self._results[veh_id][_VAR_SPEED]
+
+    def co2_emission(self, veh_id):
+        """Returns the cached CO2 emission of `veh_id` from the last `update`.
+
+        Raises
+        ------
+        KeyError
+            If `veh_id` was not part of the last update."""
+        return self._results[veh_id][_VAR_CO2EMISSION]
+
+    def waiting_time(self, veh_id):
+        """Returns the cached waiting time of `veh_id` from the last `update`.
+
+        Raises
+        ------
+        KeyError
+            If `veh_id` was not part of the last update."""
+        return self._results[veh_id][_VAR_WAITING_TIME]
+
     def speeds(self, ids):
         """Encodes vehicle speeds into a vector representation.
 
@@ -118,15 +248,15 @@ class VehicleStates:
 
         Returns
         -------
-        encoded_state: List<Float>
+        encoded_state: np.ndarray of float32
              Encoded orientations in same order as `ids`."""
-        odict = self._get_odict(0.)
-        for veh_id in ids:
-            try:
-                odict[veh_id] = traci.vehicle.getSpeed(veh_id)
-            except:
-                odict[veh_id] = 0.
-        return self._odict_to_list(odict)
+        rows, n = self._rows(ids)
+        self._speed_buf = self._fit(self._speed_buf, n)
+        out = self._speed_buf[:n]
+        out.fill(0.)
+        for veh_id, row in zip(ids, rows):
+            out[row] = self._results.get(veh_id, {}).get(_VAR_SPEED, 0.)
+        return out
 
     def orientations(self, ids):
         """Encodes vehicle orientation into a vector representation.
@@ -140,17 +270,18 @@ class VehicleStates:
 
         Returns
         -------
-        encoded_state: List<Float> of length `3 * len(ids)`
+        encoded_state: np.ndarray of float32, 3 values per row
              Encoded orientations in same order as `ids`."""
-        odict = self._get_odict([0., 0., 0.])
-        for veh_id in ids:
-            try:
-                x, y = traci.vehicle.getPosition(veh_id)
-                angle = traci.vehicle.getAngle(veh_id)
-                odict[veh_id] = [x, y, angle]
-            except:
-                odict[veh_id] = [0., 0., 0.]
-        return flatten(self._odict_to_list(odict))
+        rows, n = self._rows(ids)
+        self._orient_buf = self._fit(self._orient_buf, n)
+        out = self._orient_buf[:n]
+        out.fill(0.)
+        for veh_id, row in zip(ids, rows):
+            result = self._results.get(veh_id)
+            if result:
+                out[row, :2] = result[_VAR_POSITION]
+                out[row, 2] = result[_VAR_ANGLE]
+        return out.ravel()
 
     def CO2_emissions(self, ids):
         """Encodes vehicle CO2 emissions into a vector representation.
@@ -162,15 +293,43 @@ class VehicleStates:
 
         Returns
         -------
-        encoded_state: List<Float>
+        encoded_state: np.ndarray of float32
              Encoded CO2 emissions in same order as `ids`."""
-        odict = self._get_odict(0.)
-        for veh_id in ids:
-            try:
-                odict[veh_id] = traci.vehicle.getCO2Emission(veh_id)
-            except:
-                odict[veh_id] = 0.
-        return self._odict_to_list(odict)
+        rows, n = self._rows(ids)
+        self._co2_buf = self._fit(self._co2_buf, n)
+        out = self._co2_buf[:n]
+        out.fill(0.)
+        for veh_id, row in zip(ids, rows):
+            out[row] = self._results.get(veh_id, {}).get(_VAR_CO2EMISSION, 0.)
+        return out
+
+    def pack(self, ids):
+        """Encodes speeds, orientations and CO2 emissions in one pass.
+
+        Equivalent to concatenating `speeds`, `orientations` and
+        `CO2_emissions` for the same `ids`, but the rows are resolved once
+        and scattered by a compiled kernel.
+
+        Parameters
+        ----------
+        ids: List<String>
+            List of vehicle ids to encode in state vector.
+
+        Returns
+        -------
+        encoded_state: np.ndarray of float32 of length `5 * rows`
+             Speeds, then (x, y, angle) triples, then CO2 emissions."""
+        rows, n = self._rows(ids)
+        vals = np.zeros((len(ids), 5), dtype=np.float32)
+        for i, veh_id in enumerate(ids):
+            result = self._results.get(veh_id)
+            if result:
+                x, y = result[_VAR_POSITION]
+                vals[i] = (result[_VAR_SPEED], x, y, result[_VAR_ANGLE], result[_VAR_CO2EMISSION])
+        self._pack_buf = self._fit(self._pack_buf, 5 * n)
+        out = self._pack_buf[:5 * n]
+        pack_vehicle_state(np.asarray(rows, dtype=np.int64), vals, n, out)
+        return out
 
     def wait_steps(self, veh_wait_steps):
         """Encodes steps vehicles spent idled into a vector representation.
@@ -182,17 +341,23 @@ class VehicleStates:
 
         Returns
         -------
-        encoded_state: List<Float>
+        encoded_state: np.ndarray of float32
              Encoded wait_steps in same order as `ids`."""
-        odict = self._get_odict(0.)
-        for veh_id in veh_wait_steps.keys():
-            odict[veh_id] = veh_wait_steps[veh_id]
-        return self._odict_to_list(odict)
+        rows, n = self._rows(veh_wait_steps)
+        self._wait_buf = self._fit(self._wait_buf, n)
+        out = self._wait_buf[:n]
+        out.fill(0.)
+        out[rows] = list(veh_wait_steps.values())
+        return out
 
 
 class States:
-    """Combined state representation for traffic lights and vehicles."""
+    """Combined state representation for traffic lights and vehicles.
+
+    `conn` is the TraCI connection to read from; when None the encoders use
+    whichever connection the traci module currently has active.
+    """
     
-    def __init__(self, beta):
-        self.tl = TrafficLightsStates()
-        self.veh = VehicleStates(beta)
+    def __init__(self, beta, conn=None):
+        self.tl = TrafficLightsStates(conn)
+        self.veh = VehicleStates(beta, conn)
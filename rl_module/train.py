@@ -7,6 +7,7 @@ Usage:
     python train.py                          # Default: 200k steps, headless
     python train.py --timesteps 100000       # Shorter run
     python train.py --timesteps 20000 --lr 0.0003  # Quick test run
+    python train.py --gui                    # Watch training in sumo-gui (TraCI)
 """
 
 import os
@@ -26,6 +27,12 @@ for p in (PROJECT_ROOT, SCRIPT_DIR):
     if p not in sys.path:
         sys.path.insert(0, p)
 
+# Run SUMO in-process through libsumo (TraCI API, no socket round-trips).
+# traci reads this on first import, so it has to be set before vanet_env is
+# loaded; libsumo cannot drive sumo-gui, so --gui keeps the socket client.
+if '--traci' not in sys.argv and '--gui' not in sys.argv:
+    os.environ.setdefault('LIBSUMO_AS_TRACI', 'quiet')
+
 import numpy as np
 import traci
 from stable_baselines3 import DQN
@@ -38,6 +45,12 @@ from stable_baselines3.common.monitor import Monitor
 from vanet_env import VANETTrafficEnv
 
 
+def _switch(label: str):
+    """Make `label` the active connection (libsumo only ever has one)."""
+    if hasattr(traci, "switch"):
+        traci.switch(label)
+
+
 # ---------------------------------------------------------------------------
 # Custom callback – restarts SUMO when an episode ends (horizon reached)
 # ---------------------------------------------------------------------------
@@ -82,7 +95,7 @@ class SUMOResetCallback(BaseCallback):
                 pass
             try:
                 traci.start(self.sumo_cmd, label=self.label)
-                traci.switch(self.label)
+                _switch(self.label)
             except Exception as e:
                 print(f"  ⚠️  SUMO restart error: {e}")
 
@@ -106,11 +119,11 @@ class SUMOEnvWrapper(Monitor):
         if not self._sumo_running:
             try:
                 traci.start(self.sumo_cmd, label=self.label)
-                traci.switch(self.label)
+                _switch(self.label)
                 self._sumo_running = True
             except traci.exceptions.TraCIException:
                 # Already connected
-                traci.switch(self.label)
+                _switch(self.label)
                 self._sumo_running = True
 
     def reset(self, **kwargs):
@@ -139,10 +152,10 @@ class SUMOEnvWrapper(Monitor):
 # ---------------------------------------------------------------------------
 # Build SUMO command and the Gym environment
 # ---------------------------------------------------------------------------
-def build_env(config_path: str, log_dir: Optional[str] = None):
+def build_env(config_path: str, log_dir: Optional[str] = None, gui: bool = False):
     """Create the SB3-compatible VANET environment around SUMO."""
 
-    sumo_binary = "sumo"  # headless – no GUI during training
+    sumo_binary = "sumo-gui" if gui else "sumo"  # headless unless asked
     sumo_cmd = [
         sumo_binary,
         "-c", config_path,
@@ -156,7 +169,7 @@ def build_env(config_path: str, log_dir: Optional[str] = None):
 
     # Start SUMO once to inspect traffic lights
     traci.start(sumo_cmd, label=label)
-    traci.switch(label)
+    _switch(label)
 
     tl_ids = traci.trafficlight.getIDList()
     action_spec = {}
@@ -213,6 +226,7 @@ def train(
     exploration_final_eps: float = 0.05,
     target_update_interval: int = 1_000,
     save_freq: int = 10_000,
+    gui: bool = False,
 ):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     model_dir = os.path.join(output_dir, f"dqn_traffic_{timestamp}")
@@ -236,7 +250,7 @@ def train(
     print("Setting up SUMO environment …")
     log_dir = os.path.join(model_dir, "logs")
     os.makedirs(log_dir, exist_ok=True)
-    env, sumo_cmd, label = build_env(config_path, log_dir=log_dir)
+    env, sumo_cmd, label = build_env(config_path, log_dir=log_dir, gui=gui)
 
     # ---- model ----
     print("\nCreating DQN model …")
@@ -478,6 +492,8 @@ def main():
     parser.add_argument("--gamma", type=float, default=0.99, help="Discount factor")
     parser.add_argument("--exploration", type=float, default=0.30, help="Exploration fraction")
     parser.add_argument("--save-freq", type=int, default=10_000, help="Checkpoint frequency (steps)")
+    parser.add_argument("--gui", action="store_true", help="Run sumo-gui (uses the TraCI socket client)")
+    parser.add_argument("--traci", action="store_true", help="Use the TraCI socket client instead of libsumo")
 
     args = parser.parse_args()
 
@@ -495,6 +511,7 @@ def main():
         gamma=args.gamma,
         exploration_fraction=args.exploration,
         save_freq=args.save_freq,
+        gui=args.gui,
     )
 
     if model_path:
@@ -8,8 +8,6 @@ import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
 import traci
-from collections import OrderedDict
-import itertools
 
 # Import with proper path handling
 import sys
@@ -20,6 +18,10 @@ from rewards import Rewards
 from states import States
 from emergency_coordinator import EmergencyVehicleCoordinator
 
+# TraCI lane variable ids (see traci.constants)
+_LAST_STEP_VEHICLE_ID_LIST = 0x12
+_LAST_STEP_OCCUPANCY = 0x13
+
 
 class VANETTrafficEnv(gym.Env):
     """
@@ -48,6 +50,12 @@ class VANETTrafficEnv(gym.Env):
             - sim_step: simulation step size in seconds
             - algorithm: 'DQN' or 'PPO'
             - horizon: episode length
+            - use_subscriptions: read per-vehicle and per-lane values from
+              one batched TraCI subscription fetch per step instead of one
+              query each
+            - connection: TraCI connection of this environment's simulation
+              (``traci.getConnection(label)``); defaults to the module-level
+              traci, i.e. whichever connection is active
         """
         super(VANETTrafficEnv, self).__init__()
         
@@ -60,6 +68,8 @@ class VANETTrafficEnv(gym.Env):
             'sim_step': 1.0,
             'algorithm': 'DQN',
             'horizon': 1000,
+            'use_subscriptions': True,
+            'connection': None,
         }
         
         self.config = {**default_config, **(config or {})}
@@ -72,13 +82,31 @@ class VANETTrafficEnv(gym.Env):
         self.sim_step = self.config['sim_step']
         self.algorithm = self.config['algorithm']
         self.horizon = self.config['horizon']
+        self.use_subscriptions = self.config['use_subscriptions']
+        
+        # All TraCI calls go through this handle, so several environments can
+        # share a process without traci.switch between them
+        self.conn = self.config['connection'] if self.config['connection'] is not None else traci
+        
+        # Set when step() already fetched this step's vehicle subscription results
+        self._veh_results_fresh = False
+        
+        # Per-step TraCI results, cleared whenever the simulation advances
+        self._veh_ids = None
+        self._lane_results = None
+        
+        # Static network queries, cached on first use
+        self._controlled_tl_ids = None
+        self._controlled_links = {}
+        self._controlled_lanes = None
         
         # Initialize RL components
-        self.rewards = Rewards(self.action_spec)
-        self.states = States(self.beta)
+        self.states = States(self.beta, self.conn)
+        self.rewards = Rewards(self.action_spec, self.conn,
+                               veh=self.states.veh if self.use_subscriptions else None)
         
         # Initialize emergency vehicle coordinator
-        self.emergency_coordinator = EmergencyVehicleCoordinator(rsu_range=300.0)
+        self.emergency_coordinator = EmergencyVehicleCoordinator(rsu_range=300.0, conn=self.conn)
         self.emergency_coordinator_initialized = False
         
         # Initialize tracking variables
@@ -103,10 +131,20 @@ class VANETTrafficEnv(gym.Env):
         
     def _setup_spaces(self):
         """Setup action and observation spaces for the RL algorithm."""
+        # Per-light phase lists, indexed by map_action_to_tl_states
+        self._action_spec_values = [list(states) for states in self.action_spec.values()]
+        
         # Action space
         if self.algorithm == "DQN":
             num_actions = self.get_num_actions()
             self.action_space = spaces.Discrete(num_actions)
+            self._decode_action = self._build_action_decoder()
+            
+            # Place value of each light's phase index in the flat action
+            radices = [len(states) for states in self._action_spec_values]
+            self._action_strides = np.ones(len(radices), dtype=np.int64)
+            for i in reversed(range(len(radices) - 1)):
+                self._action_strides[i] = self._action_strides[i + 1] * radices[i + 1]
         elif self.algorithm == "PPO":
             num_intersections = len(self.action_spec.keys())
             self.action_space = spaces.Box(
@@ -135,44 +173,49 @@ class VANETTrafficEnv(gym.Env):
             shape=(obs_dim,), 
             dtype=np.float32
         )
+        
+        # Reused by get_state; sections are written into it back to back
+        self._state_buf = np.zeros(obs_dim, dtype=np.float32)
     
     def _init_obs_veh_acc(self):
         """Initializes the data structures that will store vehicle speeds and accelerations"""
-        self._obs_veh_vel = OrderedDict([('vehicle_' + str(i), 0) for i in range(self.beta)])
-        self.obs_veh_acc = OrderedDict([('vehicle_' + str(i), [0]) for i in range(self.beta)])
+        self._obs_veh_vel = {'vehicle_' + str(i): 0 for i in range(self.beta)}
+        self.obs_veh_acc = {'vehicle_' + str(i): [0] for i in range(self.beta)}
+
+    def _gather_obs_veh_speeds(self, obs_veh_ids):
+        """Reads the observed vehicles' speeds once for the per-step trackers.
 
-    def _update_obs_veh_acc(self):
+        Speeds that could not be read are None."""
+        speeds = []
+        for veh_id in obs_veh_ids:
+            try:
+                speeds.append(self._veh_speed(veh_id))
+            except:
+                speeds.append(None)
+        return speeds
+
+    def _update_obs_veh_acc(self, obs_veh_ids, speeds):
         """Updates the observed vehicle speed and acceleration data structures."""
         placeholder = 0.
-        obs_veh_ids = self.get_observable_veh_ids()
 
         # Create speed dict with actual vehicle IDs
-        speed_odict = OrderedDict()
-        for i, veh_id in enumerate(obs_veh_ids[:self.beta]):
-            try:
-                speed_odict[veh_id] = traci.vehicle.getSpeed(veh_id)
-            except:
-                speed_odict[veh_id] = 0.
+        new_speeds = {}
+        for veh_id, speed in zip(obs_veh_ids[:self.beta], speeds):
+            new_speeds[veh_id] = 0. if speed is None else speed
 
         # Fill remaining slots with placeholders
-        for i in range(len(speed_odict), self.beta):
-            speed_odict['vehicle_' + str(i)] = placeholder
+        for i in range(len(new_speeds), self.beta):
+            new_speeds['vehicle_' + str(i)] = placeholder
 
         # Update accelerations
-        for veh_id in speed_odict.keys():
-            if veh_id in self._obs_veh_vel:
-                new_acc = (speed_odict[veh_id] - self._obs_veh_vel[veh_id]) / self.sim_step
-            else:
-                new_acc = 0.
-
-            if veh_id not in self.obs_veh_acc:
-                self.obs_veh_acc[veh_id] = [0]
+        for veh_id, speed in new_speeds.items():
+            prev = self._obs_veh_vel.get(veh_id)
+            new_acc = 0. if prev is None else (speed - prev) / self.sim_step
 
-            list_acc = self.obs_veh_acc[veh_id].copy()
-            list_acc.append(new_acc)
-            self.obs_veh_acc[veh_id] = list_acc
+            # Appended in place: penalize_max_acc scores the whole history
+            self.obs_veh_acc.setdefault(veh_id, [0]).append(new_acc)
 
-        self._obs_veh_vel = speed_odict
+        self._obs_veh_vel = new_speeds
 
     def _init_obs_veh_wait_steps(self):
         """Initializes attributes that will store the number of steps stayed idle by vehicles"""
@@ -187,10 +230,78 @@ class VANETTrafficEnv(gym.Env):
             for tl_id in self._all_tl_names
         }
     
+    def _veh_speed(self, veh_id):
+        """Speed of a vehicle, from this step's subscription results if enabled."""
+        if self.use_subscriptions:
+            return self.states.veh.speed(veh_id)
+        return self.conn.vehicle.getSpeed(veh_id)
+    
+    def _veh_waiting_time(self, veh_id):
+        """Waiting time of a vehicle, from this step's subscription results if enabled."""
+        if self.use_subscriptions:
+            return self.states.veh.waiting_time(veh_id)
+        return self.conn.vehicle.getWaitingTime(veh_id)
+    
+    def invalidate_step_cache(self):
+        """Drops the vehicle ids and subscription results cached for this step.
+        
+        `step` and `reset` call this themselves; callers that advance SUMO
+        outside of them (e.g. ``simulationStep(target)``) must call it
+        before reading from the env again.
+        """
+        self._veh_ids = None
+        self._lane_results = None
+        self._veh_results_fresh = False
+    
+    def _vehicle_ids(self):
+        """Ids of the vehicles on the map, queried once per simulation step."""
+        if self._veh_ids is None:
+            self._veh_ids = self.conn.vehicle.getIDList()
+        return self._veh_ids
+    
+    def _lane_value(self, lane_id, var):
+        """Reads a lane variable, from this step's subscription results if enabled.
+        
+        Lanes are subscribed on first use, and again after a reload drops
+        their subscription. A lane someone else subscribed to other
+        variables (e.g. the hybrid runners' vehicle counts) is subscribed
+        too; SUMO merges the variable lists.
+        """
+        if not self.use_subscriptions:
+            if var == _LAST_STEP_VEHICLE_ID_LIST:
+                return self.conn.lane.getLastStepVehicleIDs(lane_id)
+            return self.conn.lane.getLastStepOccupancy(lane_id)
+        if self._lane_results is None:
+            self._lane_results = self.conn.lane.getAllSubscriptionResults()
+        result = self._lane_results.get(lane_id)
+        if not result or var not in result:
+            self.conn.lane.subscribe(lane_id, [_LAST_STEP_VEHICLE_ID_LIST, _LAST_STEP_OCCUPANCY])
+            result = self._lane_results[lane_id] = self.conn.lane.getSubscriptionResults(lane_id)
+        return result[var]
+    
+    def _get_controlled_links(self, tl_id):
+        """Controlled links of a traffic light (static, queried once)."""
+        links = self._controlled_links.get(tl_id)
+        if links is None:
+            links = self._controlled_links[tl_id] = self.conn.trafficlight.getControlledLinks(tl_id)
+        return links
+    
+    def _get_controlled_lanes(self):
+        """Distinct lanes controlled by the RL traffic lights (static, queried once)."""
+        if self._controlled_lanes is None:
+            all_lanes = []
+            for tl_id in self.action_spec.keys():
+                try:
+                    all_lanes.extend(self.conn.trafficlight.getControlledLanes(tl_id))
+                except:
+                    pass
+            self._controlled_lanes = list(set(all_lanes))
+        return self._controlled_lanes
+    
     def get_observable_veh_ids(self):
         """Get the ids of all the vehicles observable by the model."""
         try:
-            all_vehs = traci.vehicle.getIDList()
+            all_vehs = self._vehicle_ids()
             
             # Update tracking of all vehicles
             for veh in all_vehs:
@@ -209,11 +320,13 @@ class VANETTrafficEnv(gym.Env):
     
     def get_controlled_tl_ids(self):
         """Returns the list of RL controlled traffic lights."""
-        try:
-            all_tls = traci.trafficlight.getIDList()
-            return [tl_id for tl_id in all_tls if tl_id in self.action_spec.keys()]
-        except:
-            return []
+        if self._controlled_tl_ids is None:
+            try:
+                all_tls = self.conn.trafficlight.getIDList()
+            except:
+                return []
+            self._controlled_tl_ids = [tl_id for tl_id in all_tls if tl_id in self.action_spec.keys()]
+        return self._controlled_tl_ids
     
     def get_num_traffic_lights(self):
         """Counts the number of traffic lights by summing the state string length."""
@@ -239,6 +352,59 @@ class VANETTrafficEnv(gym.Env):
         else:
             raise NotImplementedError
     
+    def _build_action_decoder(self):
+        """
+        Generate a decoder from a flat DQN action to per-light phase indices.
+        
+        The flat action enumerates ``itertools.product`` over the action spec,
+        so the last traffic light varies fastest. The phase counts are baked
+        into the generated source as constants, turning the decode into
+        straight-line modulo/divide arithmetic with no loop.
+        
+        Returns
+        -------
+        callable
+            ``_decode_action(a) -> tuple of int``; out-of-range actions
+            decode to phase 0 everywhere
+        """
+        radices = [len(states) for states in self.action_spec.values()]
+        num_actions = int(np.prod(radices)) if radices else 1
+        
+        lines = [
+            "def _decode_action(a):",
+            "    a = int(a)",
+            f"    if not 0 <= a < {num_actions}:",
+            "        a = 0",
+        ]
+        for i in reversed(range(len(radices))):
+            lines.append(f"    p{i} = a % {radices[i]}")
+            if i:
+                lines.append(f"    a //= {radices[i]}")
+        lines.append("    return (" + "".join(f"p{i}, " for i in range(len(radices))) + ")")
+        
+        namespace = {}
+        exec(compile("\n".join(lines), "<VANETTrafficEnv._decode_action>", "exec"), namespace)
+        return namespace["_decode_action"]
+    
+    def encode_action(self, phase_indices):
+        """
+        Encode per-light phase indices as a flat DQN action.
+        
+        Inverse of ``_decode_action``: the last traffic light varies
+        fastest, as in ``itertools.product`` over the action spec.
+        
+        Parameters
+        ----------
+        phase_indices : sequence of int
+            Phase index of each traffic light, in ``action_spec`` order
+        
+        Returns
+        -------
+        int
+            Flat action for ``step``
+        """
+        return int(np.dot(phase_indices, self._action_strides))
+    
     def map_action_to_tl_states(self, rl_actions):
         """Maps an rl_action to new traffic light states."""
         if not self.action_spec:
@@ -246,15 +412,14 @@ class VANETTrafficEnv(gym.Env):
         
         new_state = []
         if self.algorithm == "DQN":
-            all_actions = list(itertools.product(*list(self.action_spec.values())))
-            if rl_actions < len(all_actions):
-                new_state = all_actions[rl_actions]
-            else:
-                new_state = all_actions[0]
+            new_state = [
+                states[i]
+                for states, i in zip(self._action_spec_values, self._decode_action(rl_actions))
+            ]
         elif self.algorithm == "PPO":
             new_state = [
                 v[int(rl_actions[i])] 
-                for i, v in enumerate(list(self.action_spec.values()))
+                for i, v in enumerate(self._action_spec_values)
             ]
         else:
             raise NotImplementedError
@@ -263,7 +428,7 @@ class VANETTrafficEnv(gym.Env):
         new_state = list(new_state)
         for i, tl_id in enumerate(self.action_spec.keys()):
             try:
-                current_state = traci.trafficlight.getRedYellowGreenState(tl_id)
+                current_state = self.conn.trafficlight.getRedYellowGreenState(tl_id)
                 timer_value = self.obs_tl_wait_steps[tl_id]['timer']
                 
                 if timer_value < self.tl_constraint_min:
@@ -302,28 +467,22 @@ class VANETTrafficEnv(gym.Env):
         for counter, tl_id in enumerate(self.action_spec.keys()):
             try:
                 if counter < len(new_tl_states):
-                    traci.trafficlight.setRedYellowGreenState(tl_id, new_tl_states[counter])
+                    self.conn.trafficlight.setRedYellowGreenState(tl_id, new_tl_states[counter])
             except Exception as e:
                 print(f"Error setting traffic light {tl_id}: {e}")
     
-    def _update_obs_wait_steps(self):
+    def _update_obs_wait_steps(self, obs_veh_ids, speeds):
         """Update vehicle wait steps."""
-        obs_veh_ids = self.get_observable_veh_ids()
+        wait_steps = self.obs_veh_wait_steps
         
         # Update wait steps for observed vehicles
-        for veh_id in obs_veh_ids:
-            try:
-                speed = traci.vehicle.getSpeed(veh_id)
-                if veh_id not in self.obs_veh_wait_steps:
-                    self.obs_veh_wait_steps[veh_id] = 0
-                    
-                if speed < 0.1:  # Vehicle is waiting
-                    self.obs_veh_wait_steps[veh_id] += 1
-                else:
-                    self.obs_veh_wait_steps[veh_id] = 0
-            except:
-                if veh_id not in self.obs_veh_wait_steps:
-                    self.obs_veh_wait_steps[veh_id] = 0
+        for veh_id, speed in zip(obs_veh_ids, speeds):
+            if speed is None:
+                wait_steps.setdefault(veh_id, 0)
+            elif speed < 0.1:  # Vehicle is waiting
+                wait_steps[veh_id] = wait_steps.get(veh_id, 0) + 1
+            else:
+                wait_steps[veh_id] = 0
         
         # Patch for missing vehicles
         for k in self._all_obs_veh_names:
@@ -344,24 +503,29 @@ class VANETTrafficEnv(gym.Env):
             item[-1] for item in self.obs_veh_acc.values()
         ]
         
-        state = np.concatenate((
-            self.states.veh.speeds(veh_ids),
-            self.states.veh.orientations(veh_ids),
-            self.states.veh.CO2_emissions(veh_ids),
+        if not self._veh_results_fresh:
+            self.states.veh.update(veh_ids)
+        self._veh_results_fresh = False
+        sections = (
+            self.states.veh.pack(veh_ids),
             self.states.veh.wait_steps(self.obs_veh_wait_steps),
             current_accelerations,
             self.states.tl.binary_state_ohe(tl_ids) if tl_ids else [0],
             self.states.tl.wait_steps(self.obs_tl_wait_steps),
-        ))
-        
-        # Ensure state matches observation space
-        expected_size = self.observation_space.shape[0]
-        if len(state) < expected_size:
-            state = np.pad(state, (0, expected_size - len(state)), 'constant')
-        elif len(state) > expected_size:
-            state = state[:expected_size]
+        )
         
-        return state.astype(np.float32)
+        # Sections vary in length as vehicles come and go, so fill the
+        # buffer in order, truncate to the observation space and zero the rest
+        state = self._state_buf
+        pos = 0
+        for section in sections:
+            n = min(len(section), state.size - pos)
+            state[pos:pos + n] = section[:n]
+            pos += n
+        state[pos:] = 0.
+        
+        # Callers keep observations across steps, so hand out a copy
+        return state.copy()
     
     def compute_reward(self, rl_actions):
         """
@@ -394,7 +558,7 @@ class VANETTrafficEnv(gym.Env):
             active_emergencies = self.emergency_coordinator.get_active_emergency_vehicles()
             
             # Get current vehicle list to avoid querying non-existent vehicles
-            current_vehicles = set(traci.vehicle.getIDList())
+            current_vehicles = set(self._vehicle_ids())
             
             if active_emergencies:
                 for emerg_veh in active_emergencies:
@@ -406,8 +570,8 @@ class VANETTrafficEnv(gym.Env):
                         if veh_id not in current_vehicles:
                             continue
                         
-                        speed = traci.vehicle.getSpeed(veh_id)
-                        waiting_time = traci.vehicle.getWaitingTime(veh_id)
+                        speed = self._veh_speed(veh_id)
+                        waiting_time = self._veh_waiting_time(veh_id)
                         
                         # HUGE bonus for emergency vehicles moving at good speed
                         if speed > 10.0:  # Moving faster than 10 m/s (36 km/h)
@@ -439,24 +603,13 @@ class VANETTrafficEnv(gym.Env):
         queue_penalty = 0
         try:
             # Check queue lengths across all lanes
-            all_lanes = []
-            for tl_id in self.action_spec.keys():
-                try:
-                    controlled_lanes = traci.trafficlight.getControlledLanes(tl_id)
-                    all_lanes.extend(controlled_lanes)
-                except:
-                    pass
-            
-            # Remove duplicates
-            all_lanes = list(set(all_lanes))
-            
-            for lane_id in all_lanes:
+            for lane_id in self._get_controlled_lanes():
                 try:
                     # Get vehicles on lane
-                    vehicles_on_lane = traci.lane.getLastStepVehicleIDs(lane_id)
+                    vehicles_on_lane = self._lane_value(lane_id, _LAST_STEP_VEHICLE_ID_LIST)
                     if vehicles_on_lane:
                         # Calculate average speed on this lane
-                        speeds = [traci.vehicle.getSpeed(v) for v in vehicles_on_lane[:5]]  # First 5 vehicles
+                        speeds = [self._veh_speed(v) for v in vehicles_on_lane[:5]]  # First 5 vehicles
                         avg_speed = sum(speeds) / len(speeds) if speeds else 0
 
                         # Heavily penalize slow-moving traffic (congestion indicator)
@@ -487,6 +640,9 @@ class VANETTrafficEnv(gym.Env):
 
         self.current_step = 0
         self.episode_reward = 0
+        
+        # The simulation may have been reloaded or advanced externally
+        self.invalidate_step_cache()
 
         # Reset tracking variables
         self._init_obs_veh_acc()
@@ -522,7 +678,7 @@ class VANETTrafficEnv(gym.Env):
                 self.emergency_coordinator.initialize_network_topology()
                 self.emergency_coordinator_initialized = True
             
-            current_time = traci.simulation.getTime()
+            current_time = self.conn.simulation.getTime()
             
             # Detect emergency vehicles via RSUs
             emergency_vehicles = self.emergency_coordinator.detect_emergency_vehicles(current_time)
@@ -553,12 +709,12 @@ class VANETTrafficEnv(gym.Env):
                             
                             # For emergency vehicles, force change even if min green not met
                             if timer >= self.tl_constraint_min or timer < 3:
-                                traci.trafficlight.setPhase(tl_id, phase_idx)
+                                self.conn.trafficlight.setPhase(tl_id, phase_idx)
                                 self.successful_greenwaves += 1
                                 print(f"🟢 Greenwave: {tl_id} set to phase {phase_idx} for {emerg_veh.vehicle_id}")
                             else:
                                 # Emergency override - force immediate change
-                                traci.trafficlight.setPhase(tl_id, phase_idx)
+                                self.conn.trafficlight.setPhase(tl_id, phase_idx)
                                 self.successful_greenwaves += 1
                                 print(f"🚨 Emergency override: {tl_id} forced to phase {phase_idx} for {emerg_veh.vehicle_id}")
                 
@@ -570,7 +726,7 @@ class VANETTrafficEnv(gym.Env):
     def density_based_override(self):
         """Override traffic lights based on vehicle density when no emergency vehicles are detected."""
         try:
-            all_vehicles = traci.vehicle.getIDList()
+            all_vehicles = self._vehicle_ids()
             emergency_detected = any(
                 'emergency' in veh_id.lower() or 'ambulance' in veh_id.lower() or 'fire' in veh_id.lower()
                 for veh_id in all_vehicles
@@ -584,11 +740,11 @@ class VANETTrafficEnv(gym.Env):
 
             # Measure density for all lanes connected to traffic lights
             for tl_id in controlled_tls:
-                connections = traci.trafficlight.getControlledLinks(tl_id)
+                connections = self._get_controlled_links(tl_id)
                 for link in connections:
                     lane_id = link[0][0]  # Get lane ID
                     try:
-                        density = traci.lane.getLastStepOccupancy(lane_id)  # Get density
+                        density = self._lane_value(lane_id, _LAST_STEP_OCCUPANCY)  # Get density
                         lane_densities[lane_id] = density
                     except Exception as e:
                         print(f"Error getting density for lane {lane_id}: {e}")
@@ -600,14 +756,14 @@ class VANETTrafficEnv(gym.Env):
 
                 # Set appropriate phase for the traffic light controlling the lane with the highest density
                 for tl_id in controlled_tls:
-                    connections = traci.trafficlight.getControlledLinks(tl_id)
+                    connections = self._get_controlled_links(tl_id)
                     for link_index, link in enumerate(connections):
                         if link[0][0] == max_density_lane:  # Match lane to traffic light
                             phase_index = self._find_phase_for_link(tl_id, link_index)
                             if phase_index is not None:
                                 # Hysteresis: only override if density sufficiently higher than current green lanes
                                 # Compute current green lanes density
-                                current_state = traci.trafficlight.getRedYellowGreenState(tl_id)
+                                current_state = self.conn.trafficlight.getRedYellowGreenState(tl_id)
                                 green_indices = [i for i, ch in enumerate(current_state) if ch == 'G']
                                 green_density = 0.0
                                 if green_indices:
@@ -615,7 +771,7 @@ class VANETTrafficEnv(gym.Env):
                                     for gi in green_indices:
                                         try:
                                             lane_i = connections[gi][0][0]
-                                            vals.append(traci.lane.getLastStepOccupancy(lane_i))
+                                            vals.append(self._lane_value(lane_i, _LAST_STEP_OCCUPANCY))
                                         except Exception:
                                             pass
                                     if vals:
@@ -625,7 +781,7 @@ class VANETTrafficEnv(gym.Env):
                                 if max_density > max(green_density * 1.2, 0.05):
                                     timer = self.obs_tl_wait_steps.get(tl_id, {}).get('timer', 0)
                                     if timer >= self.tl_constraint_min:
-                                        traci.trafficlight.setPhase(tl_id, phase_index)
+                                        self.conn.trafficlight.setPhase(tl_id, phase_index)
                                         print(f"Density-based override: Set phase {phase_index} for lane {max_density_lane} at traffic light {tl_id} with density {max_density}")
                                         return
                                     else:
@@ -642,7 +798,7 @@ class VANETTrafficEnv(gym.Env):
         """
         try:
             # Get all program logics (including phases)
-            programs = traci.trafficlight.getAllProgramLogics(tl_id)
+            programs = self.conn.trafficlight.getAllProgramLogics(tl_id)
             if not programs:
                 return None
             # Use the first program's phases
@@ -667,7 +823,8 @@ class VANETTrafficEnv(gym.Env):
 
         # Advance simulation
         try:
-            traci.simulationStep()
+            self.conn.simulationStep()
+            self.invalidate_step_cache()
         except Exception as e:
             print(f"Error advancing simulation: {e}")
             # Return a safe state if simulation fails
@@ -680,9 +837,16 @@ class VANETTrafficEnv(gym.Env):
 
         # Update tracking
         try:
-            self._update_obs_wait_steps()
+            if self.use_subscriptions:
+                # One batched fetch serves every per-vehicle read this step,
+                # for the observation, the reward and the info dict
+                self.states.veh.update(self._vehicle_ids())
+                self._veh_results_fresh = True
+            obs_veh_ids = self.get_observable_veh_ids()
+            speeds = self._gather_obs_veh_speeds(obs_veh_ids)
+            self._update_obs_wait_steps(obs_veh_ids, speeds)
             self._increment_obs_tl_wait_steps()
-            self._update_obs_veh_acc()
+            self._update_obs_veh_acc(obs_veh_ids, speeds)
         except Exception as e:
             print(f"Error updating observations: {e}")
 